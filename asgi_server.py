@@ -0,0 +1,314 @@
+import json
+import logging
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, TypeVar
+
+import anyio
+import status
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+import crud
+from logs import setup_logging
+from settings import settings
+from worker import PDFS_DIR, PdfRenderer, ingest_avatar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Задания и кэш отчётов общие у всех процессов uvicorn (они в базе), а процессы рисования у каждого свои,
+# поэтому делим их между процессами, чтобы всего их было столько, сколько задано
+renderer = PdfRenderer(
+    max(settings.PDF_WORKERS // settings.REST_WORKERS, 1), max(settings.PDF_QUEUE_SIZE // settings.REST_WORKERS, 1),
+    settings.PDF_JOBS_HISTORY, settings.PDF_CACHE_SIZE_MB * 2 ** 20, settings.PDF_JOB_TIMEOUT
+)
+
+# У каждого процесса uvicorn был бы свой кэш профилей, и запись через один процесс не сбросила бы его в остальных
+if settings.REST_WORKERS > 1:
+    crud.player_cache.maxsize = 0
+
+# Не больше потоков с запросами к базе, чем соединений в пуле: лишние всё равно ждали бы соединение
+db_limiter: anyio.CapacityLimiter | None = None
+
+
+async def run_db(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Runs a blocking crud call on a worker thread, so the event loop keeps serving other requests."""
+    return await anyio.to_thread.run_sync(partial(func, *args, **kwargs), limiter=db_limiter)
+
+
+def db_error(e: Exception) -> HTTPException:
+    if isinstance(e, crud.PoolTimeoutError):  # База занята, а не сломана: клиенту стоит повторить
+        return HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, str(e), headers={"Retry-After": "1"})
+    return HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, str(e))
+
+
+async def json_body(request: Request) -> Any:
+    try:
+        return await request.json()
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Body is not a valid JSON")
+
+
+async def get_player(request: Request):
+    try:
+        res = await run_db(crud.get_player, request.path_params["name"])
+    except Exception as e:
+        raise db_error(e)
+
+    return PlainTextResponse(str(res))
+
+
+async def get_players(request: Request):
+    try:
+        filters = {
+            "after": request.query_params.get("after"),
+            "columns": request.query_params["columns"].split(",") if request.query_params.get("columns") else None,
+            "min_wins": int(request.query_params["min_wins"]) if "min_wins" in request.query_params else None,
+            "gender": request.query_params.get("gender"),
+        }
+        limit = min(int(request.query_params.get("limit", settings.PLAYERS_PAGE_SIZE)), settings.PLAYERS_MAX_PAGE_SIZE)
+
+        if request.query_params.get("format") == "ndjson":
+            players = crud.iter_players(**filters)
+            first = await run_db(next, players, None)  # Ошибки запроса должны случиться до того, как начнётся ответ
+
+            def generate():
+                if first is not None:
+                    yield json.dumps(first) + "\n"
+                for player in players:
+                    yield json.dumps(player) + "\n"
+
+            return StreamingResponse(iterate_in_threadpool(generate()), media_type="application/x-ndjson")
+
+        players, next_cursor = await run_db(crud.get_players, max(limit, 1), **filters)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+    except Exception as e:
+        raise db_error(e)
+
+    return JSONResponse({"players": players, "next": next_cursor})
+
+
+async def get_leaderboard(request: Request):
+    order = request.query_params.get("order", "wins")
+    if order not in crud.LEADERBOARD_SCORES:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Unknown order {order}")
+    try:
+        limit = min(int(request.query_params.get("limit", settings.LEADERBOARD_SIZE)), settings.PLAYERS_MAX_PAGE_SIZE)
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+
+    try:
+        res = await run_db(crud.get_leaderboard, order, max(limit, 1))
+    except Exception as e:
+        raise db_error(e)
+
+    return JSONResponse(res)
+
+
+async def get_rank(request: Request):
+    """Place of one player in the leaderboard.
+
+    Counts the players in front of them in the index of the order, so it costs O(rank): tens of milliseconds for a
+    player in the middle of a million (see bench_leaderboard.py), well under one for the top of the table.
+    """
+    name = request.path_params["name"]
+    order = request.query_params.get("order", "wins")
+    if order not in crud.LEADERBOARD_SCORES:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Unknown order {order}")
+
+    try:
+        res = await run_db(crud.get_rank, name, order)
+    except Exception as e:
+        raise db_error(e)
+
+    if res is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"Player {name} not found")
+
+    return JSONResponse(res)
+
+
+async def get_player_cache_stats(request: Request):
+    return JSONResponse(crud.player_cache.stats())
+
+
+async def add_player(request: Request):
+    name = request.path_params["name"]
+    logger.info("Add player %s", name)
+    data = await json_body(request)
+
+    try:
+        await run_db(
+            crud.add_player,
+            name,
+            age=data.get("age"),
+            email=data.get("email"),
+            avatar="img.png",
+            wins=0,
+            losses=0,
+            time_played=0,
+            gender=data.get("gender")
+        )
+    except Exception as e:
+        logger.exception("Failed to add player %s", name)
+        raise db_error(e)
+
+    return Response()
+
+
+async def update_player(request: Request):
+    data = await json_body(request)
+
+    try:
+        await run_db(
+            crud.update_player,
+            request.path_params["name"],
+            age=data.get("age"),
+            email=data.get("email"),
+            gender=data.get("gender")
+        )
+    except Exception as e:
+        raise db_error(e)
+
+    return Response()
+
+
+async def update_avatar(request: Request):
+    name = request.path_params["name"]
+    if int(request.headers.get("content-length", 0)) > settings.REST_MAX_CONTENT_MB * 2 ** 20:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Avatar is too large")
+
+    async with request.form() as form:
+        img = form.get("avatar")
+        avatar = "img.png"
+        if img is not None and not isinstance(img, str):
+            try:
+                avatar = await anyio.to_thread.run_sync(ingest_avatar, name, img.file)
+            except ValueError as e:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+
+    try:
+        await run_db(crud.update_player, name, avatar=avatar)
+    except Exception as e:
+        raise db_error(e)
+
+    return Response()
+
+
+async def add_to_player(request: Request):
+    data = await json_body(request)
+
+    try:
+        res = await run_db(
+            crud.add_to_player,
+            request.path_params["name"],
+            wins=data.get("wins"),
+            losses=data.get("losses"),
+            time_played=data.get("time_played")
+        )
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+    except Exception as e:
+        raise db_error(e)
+
+    return PlainTextResponse(str(res))
+
+
+async def add_game_results(request: Request):
+    data = await json_body(request)
+    games = data if isinstance(data, list) else [data]
+
+    try:
+        await run_db(crud.add_game_results, games)
+    except (KeyError, TypeError) as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Bad game results: {e!r}")
+    except Exception as e:
+        raise db_error(e)
+
+    return Response()
+
+
+async def post_task(request: Request):
+    name = request.path_params["name"]
+    try:
+        data = await run_db(crud.get_player, name)
+    except Exception as e:
+        raise db_error(e)
+
+    # Ключ отчёта считается по файлу аватара, а задания лежат в базе, поэтому и это уводим с цикла событий
+    try:
+        id = await run_db(renderer.submit, name, data)
+    except Exception as e:
+        raise db_error(e)
+    if id is None:
+        return PlainTextResponse("Too many pdfs in progress, try again later",
+                                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+
+    return PlainTextResponse(
+        f"Link to get pdf: http://127.0.0.1:{settings.REST_PORT}/pdfs/{id}.pdf\n"
+        f"Link to check its status: http://127.0.0.1:{settings.REST_PORT}/pdfs/jobs/{id}",
+        status_code=status.HTTP_202_ACCEPTED
+    )
+
+
+async def get_task(request: Request):
+    id = request.path_params["id"]
+    try:
+        res = await run_db(renderer.status, id)
+    except Exception as e:
+        raise db_error(e)
+    if res is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"Job {id} not found")
+
+    if res["status"] == "done":
+        res["link"] = f"http://127.0.0.1:{settings.REST_PORT}/pdfs/{id}.pdf"
+    return JSONResponse(res)
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    global db_limiter
+    setup_logging()  # Процессы uvicorn не выполняют __main__ этого модуля
+    db_limiter = anyio.CapacityLimiter(settings.DB_POOL_SIZE)
+
+    try:
+        yield
+    finally:
+        renderer.shutdown()
+
+
+app = Starlette(
+    routes=[
+        Route("/players/{name}", get_player, methods=["GET"]),
+        Route("/players", get_players, methods=["GET"]),
+        Route("/leaderboard", get_leaderboard, methods=["GET"]),
+        Route("/leaderboard/{name}", get_rank, methods=["GET"]),
+        Route("/stats/player_cache", get_player_cache_stats, methods=["GET"]),
+        Route("/players/{name}", add_player, methods=["POST"]),
+        Route("/players/{name}", update_player, methods=["PATCH"]),
+        Route("/players/avatar/{name}", update_avatar, methods=["PATCH"]),
+        Route("/players/add_to_player/{name}", add_to_player, methods=["PATCH"]),
+        Route("/games/results", add_game_results, methods=["POST"]),
+        Route("/pdfs/{name}", post_task, methods=["POST"]),
+        Route("/pdfs/jobs/{id}", get_task, methods=["GET"]),
+        Mount("/pdfs", StaticFiles(directory=PDFS_DIR)),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    logger.info("Starting asgi rest server")
+
+    crud.init_db()
+    uvicorn.run("asgi_server:app", host="0.0.0.0", port=settings.REST_PORT, workers=settings.REST_WORKERS)
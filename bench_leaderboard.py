@@ -0,0 +1,65 @@
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from typing import Any
+
+import crud
+
+
+def fill(count: int) -> None:
+    """Adds `count` players with random results, unless the database already has them."""
+    crud.init_db()
+    with crud.pool.connection() as conn:
+        if conn.execute("SELECT COUNT(*) FROM players").fetchone()[0] >= count:
+            return
+
+        conn.executemany(
+            "INSERT OR IGNORE INTO players (name, avatar, wins, losses, time_played) VALUES (?, 'img.png', ?, ?, ?)",
+            (
+                (f"player-{i}", wins, losses, (wins + losses) * random.uniform(60, 600))
+                for i in range(count)
+                for wins, losses in [(random.randint(0, 1000), random.randint(0, 1000))]
+            )
+        )
+
+
+def timed(func: Callable[..., Any], *args: Any) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1e3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latency of the leaderboard queries on a generated database")
+    parser.add_argument("--db", default=os.path.join(tempfile.gettempdir(), "leaderboard_bench.db"),
+                        help="reused between runs once filled")
+    parser.add_argument("--players", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=100, help="random players whose rank is measured")
+    args = parser.parse_args()
+
+    crud.pool = crud.ConnectionPool(args.db, size=1, timeout=60)
+    crud.player_cache.maxsize = 0
+
+    start = time.perf_counter()
+    fill(args.players)
+    print(f"{args.players} players in {os.path.abspath(args.db)}, ready in {time.perf_counter() - start:.0f} s")
+
+    names = [f"player-{i}" for i in random.sample(range(args.players), args.samples)]
+    for order in crud.LEADERBOARD_SCORES:
+        crud.get_leaderboard(order, 10)  # Прогреваем кэш страниц индекса
+
+        top = min(timed(crud.get_leaderboard, order, 10) for _ in range(10))
+        leader = crud.get_leaderboard(order, 1)[0]["name"]
+        first = min(timed(crud.get_rank, leader, order) for _ in range(10))
+        ranks = sorted(timed(crud.get_rank, name, order) for name in names)
+
+        print(f"{order}: top-10 {top:.2f} ms, rank of the leader {first:.2f} ms, "
+              f"rank of a random player p50 {statistics.median(ranks):.1f} ms, max {ranks[-1]:.1f} ms", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import gc
+import time
+import tracemalloc
+from uuid import uuid4
+
+from enums import ActionsEnum
+from mafia import Game
+
+
+def play_until_first_death(game: Game) -> None:
+    """Makes every player take their first available action until somebody dies, as a running game would."""
+    while not game.finished and all(game.is_alive(name) for name in game.names):
+        for name in game.names:
+            if not (actions := game.get_available_actions_for_player(name)):
+                continue
+
+            action = actions[0]
+            targets = [other for other in game.names if other != name and game.is_alive(other)]
+            game.apply_action(name, action, None if action == ActionsEnum.SLEEP else targets[0])
+
+
+def make_games(count: int, players: int) -> list[Game]:
+    games = []
+    for _ in range(count):
+        game = Game(uuid4(), amount_of_players_to_start=players)
+        for seat in range(players):
+            game.add_player(f"player-{seat}")
+        game.start_game()
+        play_until_first_death(game)
+        game.get_and_delete_notifications()  # Сервер забирает их на каждом тике
+        games.append(game)
+
+    return games
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory taken by running mafia.Game objects")
+    parser.add_argument("--games", type=int, default=100_000)
+    parser.add_argument("--players", type=int, default=4)
+    args = parser.parse_args()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+
+    games = make_games(args.games, args.players)
+
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    print(f"{len(games)} games of {args.players} players after the first death: {used / 2 ** 20:.0f} MiB, "
+          f"{used / len(games):.0f} bytes per game, built in {time.perf_counter() - start:.1f} s", flush=True)
+
+
+if __name__ == "__main__":
+    main()
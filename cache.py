@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from threading import Lock
+from typing import Any
+
+
+class LRUCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after they were put.
+
+    Counts hits, misses and evictions (both for the size bound and for the ttl) for monitoring. A reader that loads
+    a value from the source takes `generation` first and passes it to `put`, so a value read before a concurrent
+    invalidation is dropped instead of being cached stale.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.key_2_entry: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.lock = Lock()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any | None:
+        with self.lock:
+            if (entry := self.key_2_entry.get(key)) is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self.key_2_entry[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self.key_2_entry.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, generation: int | None = None) -> None:
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self.key_2_entry[key] = (time.monotonic() + self.ttl, value)
+            self.key_2_entry.move_to_end(key)
+            while len(self.key_2_entry) > self.maxsize:
+                self.key_2_entry.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.key_2_entry.pop(key, None)
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self.key_2_entry),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
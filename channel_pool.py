@@ -0,0 +1,69 @@
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from threading import Lock
+
+import grpc
+
+
+@dataclass
+class PooledChannel:
+    channel: grpc.Channel
+    references: int = 0
+    idle_since: float | None = None
+
+
+class ChannelPool:
+    """Shares one gRPC channel per host:port between all stubs that talk to it.
+
+    Channels are opened on the first `acquire` (gRPC connects only on the first call), counted by references
+    and closed by `evict_idle` once nobody has used them for `idle_timeout` seconds.
+    """
+
+    def __init__(self, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self.target_2_channel: dict[str, PooledChannel] = {}
+        self.lock = Lock()
+
+        self.logger = getLogger(__name__)
+
+    def acquire(self, target: str) -> grpc.Channel:
+        with self.lock:
+            if (pooled := self.target_2_channel.get(target)) is None:
+                pooled = self.target_2_channel[target] = PooledChannel(grpc.insecure_channel(target))
+                self.logger.info("Opened channel to %s", target)
+
+            pooled.references += 1
+            pooled.idle_since = None
+
+            return pooled.channel
+
+    def release(self, target: str) -> None:
+        with self.lock:
+            if (pooled := self.target_2_channel.get(target)) is None:
+                return
+
+            pooled.references -= 1
+            if pooled.references <= 0:
+                pooled.idle_since = time.monotonic()
+
+    def evict_idle(self) -> None:
+        now = time.monotonic()
+        with self.lock:
+            idle_targets = [
+                target for target, pooled in self.target_2_channel.items()
+                if pooled.idle_since is not None and now - pooled.idle_since >= self.idle_timeout
+            ]
+            channels = [self.target_2_channel.pop(target).channel for target in idle_targets]
+
+        for target, channel in zip(idle_targets, channels):
+            channel.close()
+            self.logger.info("Closed idle channel to %s", target)
+
+    def close(self) -> None:
+        with self.lock:
+            channels = [pooled.channel for pooled in self.target_2_channel.values()]
+            self.target_2_channel = {}
+
+        for channel in channels:
+            channel.close()
@@ -1,21 +1,23 @@
-import logging
 import random
+import threading
 import time
 from concurrent import futures
 from logging import getLogger
 
 import grpc
 
+from logs import setup_logging
 from python_proto import server_pb2, server_pb2_grpc, client_pb2, client_pb2_grpc
 from settings import settings
 import google.protobuf.empty_pb2
 
 
 class ClientServicer(client_pb2_grpc.ClientServicer):
-    def __init__(self, host: str, port: int, server_host: str, server_port: int, name: str):
+    def __init__(self, host: str, port: int, server_host: str, server_port: int, name: str, subscribe: bool = False):
         self.id: int | None = None
         self.host = host
         self.port = port
+        self.subscribe = subscribe
         self.name: str = name
         self.action: str | None = None
         self.connected_player_names: set[str] = set()
@@ -29,60 +31,104 @@ class ClientServicer(client_pb2_grpc.ClientServicer):
     def NotifyJoin(self, request, context):
         self.connected_player_names.add(request.player)
 
-        self.logger.info(f"{request.player} joined the game")
-        self.logger.info(f"Currently connected players are: {self.connected_player_names}")
+        self.logger.info("%s joined the game", request.player)
+        self.logger.debug("Currently connected players are: %s", self.connected_player_names)
 
         return google.protobuf.empty_pb2.Empty()
 
     def NotifyLeave(self, request, context):
         self.connected_player_names.discard(request.player)
 
-        self.logger.info(f"{request.player} left the game")
-        self.logger.info(f"Currently connected players are: {self.connected_player_names}")
+        self.logger.info("%s left the game", request.player)
+        self.logger.debug("Currently connected players are: %s", self.connected_player_names)
 
         return google.protobuf.empty_pb2.Empty()
 
     def NotifyAction(self, request, context):
-        self.logger.info(request.notification)
+        self.logger.info("%s", request.notification)
 
         return google.protobuf.empty_pb2.Empty()
 
     def SendRole(self, request, context):
-        self.logger.info(f"Your role for this game is {request.role}")
+        self.logger.info("Your role for this game is %s", request.role)
 
         return google.protobuf.empty_pb2.Empty()
 
     def SendAvailableActions(self, request, context):
-        self.logger.info(f"Available actions: {request.actions}")
+        self.logger.info("Available actions: %s", request.actions)
 
         self.action = random.choice(request.actions)
 
         return google.protobuf.empty_pb2.Empty()
 
     def Livez(self, request, context):
-        self.logger.info("Got liveness probe")
+        self.logger.debug("Got liveness probe")
 
         response = client_pb2.LivezResponse()
         return response
 
     def connect_to_server(self):
         request = server_pb2.RegisterRequest()
-        request.host = self.host
-        request.port = self.port
+        if not self.subscribe:  # Без адреса сервер будет отправлять события только в стрим Subscribe
+            request.host = self.host
+            request.port = self.port
         request.name = self.name
 
         try:
             response = self.stub.Register(request, timeout=1)
         except grpc.RpcError as e:
-            self.logger.error("Got error while registering to server:")
-            self.logger.error(e)
+            self.logger.error("Got error while registering to server: %s", e)
         else:
             self.id = response.uuid
-            self.logger.info(f"Successfully registered to server. Your id is: {response.uuid}")
+            self.logger.info("Successfully registered to server. Your id is: %s", response.uuid)
+
+    def NotifyBatch(self, request, context):
+        for event in request.events:
+            self.handle_event(event)
+
+        return google.protobuf.empty_pb2.Empty()
+
+    def handle_event(self, event):
+        event_2_handler = {
+            "join": self.NotifyJoin,
+            "leave": self.NotifyLeave,
+            "action": self.NotifyAction,
+            "role": self.SendRole,
+            "available_actions": self.SendAvailableActions,
+        }
+
+        kind = event.WhichOneof("event")
+        event_2_handler[kind](getattr(event, kind), None)
+
+    def listen(self):
+        """Reads the event stream forever, reopening it with a growing randomized pause whenever it drops or is refused."""
+        delay = settings.CLIENT_RECONNECT_DELAY
+        while True:
+            if self.id is None:  # Регистрация не удалась или сервер нас забыл
+                self.connect_to_server()
+
+            if self.id is not None:
+                request = server_pb2.SubscribeRequest()
+                request.uuid = str(self.id)
+
+                try:
+                    for event in self.stub.Subscribe(request):
+                        delay = settings.CLIENT_RECONNECT_DELAY
+                        self.handle_event(event)
+                except grpc.RpcError as e:
+                    if e.code() == grpc.StatusCode.NOT_FOUND:
+                        self.id = None
+                    self.logger.warning("Event stream from server was closed: %s, reconnecting", e.code())
+                else:
+                    self.logger.warning("Event stream from server was closed, reconnecting")
+
+            # Случайная доля паузы, чтобы отвергнутые сервером клиенты не возвращались все разом
+            time.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, settings.CLIENT_RECONNECT_MAX_DELAY)
 
     def send_action(self):
-        if self.action is not None:
-            target_name = random.choice(list(self.connected_player_names - {self.name}))
+        if self.action is not None and (targets := list(self.connected_player_names - {self.name})):
+            target_name = random.choice(targets)
 
             action_request = server_pb2.PerformActionRequest()
             action_request.uuid = str(self.id)
@@ -94,22 +140,28 @@ class ClientServicer(client_pb2_grpc.ClientServicer):
             try:
                 self.stub.PerformAction(action_request, timeout=1)
             except grpc.RpcError as e:
-                logging.info(e)
+                self.logger.info("Action was not performed: %s", e)
 
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
     client = ClientServicer(
         settings.GRPC_CLIENT_HOST,
         settings.GRPC_CLIENT_PORT,
         settings.GRPC_SERVER_HOST,
         settings.GRPC_SERVER_PORT,
-        settings.CLIENT_NAME
+        settings.CLIENT_NAME,
+        settings.CLIENT_SUBSCRIBE
     )
-    client_pb2_grpc.add_ClientServicer_to_server(client, server)
-    server.add_insecure_port(f"{client.host}:{client.port}")
-    server.start()
 
-    client.connect_to_server()
+    if client.subscribe:  # События приходят по стриму, свой сервер клиенту не нужен
+        client.connect_to_server()
+        threading.Thread(target=client.listen, daemon=True).start()
+    else:
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
+        client_pb2_grpc.add_ClientServicer_to_server(client, server)
+        server.add_insecure_port(f"{client.host}:{client.port}")
+        server.start()
+
+        client.connect_to_server()
 
     while True:
         client.send_action()
@@ -117,5 +169,5 @@ def serve():
 
 
 if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
+    setup_logging()
     serve()
@@ -1,76 +1,396 @@
 import sqlite3
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from threading import Lock
 from typing import Any
+
+from cache import LRUCache
 from settings import settings
 
 
+class PoolTimeoutError(Exception):
+    """No pooled connection became free in time; the caller should retry later."""
+
+
+class ConnectionPool:
+    """Keeps up to `size` open SQLite connections and hands them out one request at a time.
+
+    Connections are opened lazily, tuned once with the pragmas below and reused, so a request pays neither for
+    opening the database file nor for re-preparing its statements (sqlite3 caches them per connection).
+    """
+
+    def __init__(self, path: str, size: int, timeout: float):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.created = 0
+        self.idle: LifoQueue[sqlite3.Connection] = LifoQueue()
+        self.lock = Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode = WAL")  # Читатели не блокируют писателя и наоборот
+        conn.execute("PRAGMA synchronous = NORMAL")  # В режиме WAL fsync нужен только на чекпоинте
+        conn.execute(f"PRAGMA cache_size = {-settings.DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA busy_timeout = {settings.DB_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+
+        with self.lock:
+            can_create = self.created < self.size
+            if can_create:
+                self.created += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self.lock:
+                    self.created -= 1
+                raise
+
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except Empty:
+            raise PoolTimeoutError(f"No free database connection in {self.timeout} s") from None
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Yields a pooled connection inside a transaction that commits on success and rolls back on error."""
+        conn = self._acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.idle.put(conn)
+
+    @contextmanager
+    def dedicated_connection(self) -> Iterator[sqlite3.Connection]:
+        """Like `connection`, but with a connection of its own that is closed afterwards.
+
+        For reads that last as long as a client keeps reading, so a slow client never holds a pooled connection.
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+pool = ConnectionPool(settings.DB_PATH, settings.DB_POOL_SIZE, settings.DB_POOL_TIMEOUT)
+
+# Профили игроков, прочитанные get_player; каждая запись в игрока сбрасывает его запись в кэше
+player_cache = LRUCache(settings.PLAYER_CACHE_SIZE, settings.PLAYER_CACHE_TTL)
+
+PLAYER_COLUMNS = ["name", "age", "email", "avatar", "wins", "losses", "time_played", "gender"]
+
+# Выражения должны совпадать с индексами из init_db буква в букву, иначе SQLite их не использует
+LEADERBOARD_SCORES = {
+    "wins": "wins",
+    "win_rate": "wins * 1.0 / (wins + losses)",
+    "time_played": "time_played",
+}
+
+
 def init_db() -> None:
-    with sqlite3.connect(settings.DB_PATH) as conn:
+    with pool.connection() as conn:
         cur = conn.cursor()
         cur.execute(
             """CREATE TABLE IF NOT EXISTS players (
             name TEXT PRIMARY KEY, age INTEGER, email TEXT, avatar TEXT,
              wins INTEGER, losses INTEGER, time_played FLOAT, gender TEXT)"""
         )
+        for order, score in LEADERBOARD_SCORES.items():
+            cur.execute(f"CREATE INDEX IF NOT EXISTS players_by_{order} ON players (({score}) DESC, name)")
 
-    conn.close()
+        # Задания на PDF общие для всех процессов сервера; used — когда отчёт последний раз запрашивали
+        cur.execute(
+            """CREATE TABLE IF NOT EXISTS pdf_jobs (
+            key TEXT PRIMARY KEY, status TEXT NOT NULL, error TEXT, size INTEGER, used REAL NOT NULL)"""
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS pdf_jobs_by_status ON pdf_jobs (status, used DESC)")
 
 
 def add_player(name: str, **kwargs: Any) -> None:
-    with sqlite3.connect(settings.DB_PATH) as conn:
+    with pool.connection() as conn:
         cur = conn.cursor()
-        cur.execute(f"SELECT EXISTS(SELECT 1 FROM players WHERE name='{name}');")
-
-        if cur.fetchone()[0] == 0:
-            cur.execute(
-                f"""INSERT INTO players ({', '.join(['name'] + list(kwargs.keys()))})
-                 VALUES ({', '.join('?' * (len(kwargs) + 1))})""", [name] + list(kwargs.values())
-            )
-
-    conn.close()
+        cur.execute(
+            f"""INSERT OR IGNORE INTO players ({', '.join(['name'] + list(kwargs.keys()))})
+             VALUES ({', '.join('?' * (len(kwargs) + 1))})""", [name] + list(kwargs.values())
+        )
+    player_cache.invalidate(name)
 
 
 def update_player(name: str, **kwargs: Any) -> None:
-    with sqlite3.connect(settings.DB_PATH) as conn:
+    with pool.connection() as conn:
         cur = conn.cursor()
         cur.execute(f"""UPDATE players SET
                        {', '.join([f'{column} = ?' for column in kwargs.keys()])}\
-                       WHERE name = '{name}'""",
-                    list(kwargs.values()))
-
-    conn.close()
+                       WHERE name = ?""",
+                    list(kwargs.values()) + [name])
+    player_cache.invalidate(name)
 
 
 def delete_player(name: str) -> None:
-    with sqlite3.connect(settings.DB_PATH) as conn:
+    with pool.connection() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM players WHERE name = ?", [name])
-
-    conn.close()
+    player_cache.invalidate(name)
 
 
 def get_player(name: str) -> dict | None:
-    with sqlite3.connect(settings.DB_PATH) as conn:
+    if (player := player_cache.get(name)) is not None:
+        return dict(player)
+    generation = player_cache.generation
+
+    with pool.connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM players WHERE name = ?", [name])
         res = cur.fetchone()
 
-    conn.close()
-    return {column: value for column, value in
-            zip(["name", "age", "email", "avatar", "wins", "losses", "time_played", "gender"], res)}
+    if res is None:
+        return None
+
+    player = {column: value for column, value in zip(PLAYER_COLUMNS, res)}
+    player_cache.put(name, player, generation)
+    return dict(player)
+
+
+def iter_players(
+        after: str | None = None,
+        limit: int | None = None,
+        columns: list[str] | None = None,
+        min_wins: int | None = None,
+        gender: str | None = None
+) -> Iterator[dict]:
+    """Yields players ordered by name, starting right after the `after` cursor.
+
+    Filters and the projection are done by SQLite and rows are read from the cursor lazily, so the connection is held
+    until the generator is exhausted or closed. Without a `limit` that is as long as the reader takes, so such reads
+    get a dedicated connection instead of a pooled one.
+    """
+    columns = columns or PLAYER_COLUMNS
+    if unknown := set(columns) - set(PLAYER_COLUMNS):
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+    if "name" not in columns:
+        columns = ["name"] + columns  # Имя нужно как курсор следующей страницы
+
+    conditions, params = [], []
+    if after is not None:
+        conditions.append("name > ?")
+        params.append(after)
+    if min_wins is not None:
+        conditions.append("wins >= ?")
+        params.append(min_wins)
+    if gender is not None:
+        conditions.append("gender = ?")
+        params.append(gender)
+
+    query = f"SELECT {', '.join(columns)} FROM players"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    query += " ORDER BY name"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    with pool.connection() if limit is not None else pool.dedicated_connection() as conn:
+        for row in conn.execute(query, params):
+            yield dict(zip(columns, row))
+
+
+def get_players(limit: int, **kwargs: Any) -> tuple[list[dict], str | None]:
+    """Returns one page of players and the cursor of the next page, None on the last one."""
+    players = list(iter_players(limit=limit + 1, **kwargs))
+    if len(players) <= limit:
+        return players, None
+
+    players.pop()
+    return players, players[-1]["name"]
+
+
+def add_to_player(name: str, **kwargs: Any) -> dict | None:
+    """Atomically adds the given deltas to the player's counters and returns the new totals.
+
+    Raises ValueError when every delta is None.
+    """
+    kwargs = {column: delta for column, delta in kwargs.items() if delta is not None}
+    if not kwargs:
+        raise ValueError("Nothing to add: none of the deltas is set")
+
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""UPDATE players SET
+                       {', '.join([f'{column} = COALESCE({column}, 0) + ?' for column in kwargs.keys()])}
+                       WHERE name = ? RETURNING {', '.join(kwargs.keys())}""",
+                    list(kwargs.values()) + [name])
+        res = cur.fetchall()
+    player_cache.invalidate(name)
+
+    return dict(zip(kwargs.keys(), res[0])) if res else None
 
 
-def get_players() -> list | None:
-    with sqlite3.connect(settings.DB_PATH) as conn:
+def add_to_players(deltas: list[dict[str, Any]]) -> None:
+    """Applies the deltas of several players (e.g. of one finished game) in a single transaction.
+
+    Every item holds the player's `name` and the same set of counter columns.
+    """
+    if not deltas:
+        return
+
+    with pool.connection() as conn:
+        _add_to_players(conn.cursor(), deltas)
+    player_cache.invalidate(*[item["name"] for item in deltas])
+
+
+def add_game_results(games: list[dict[str, Any]]) -> None:
+    """Records finished games in one transaction: creates the players seen for the first time and adds their stats.
+
+    Every game is `{"duration": ..., "players": [{"name": ..., "win": ...}, ...]}`.
+    """
+    deltas = [
+        {"name": player["name"], "wins": int(player["win"]), "losses": int(not player["win"]),
+         "time_played": game["duration"]}
+        for game in games for player in game["players"]
+    ]
+    if not deltas:
+        return
+
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            """INSERT OR IGNORE INTO players (name, avatar, wins, losses, time_played) VALUES (?, 'img.png', 0, 0, 0)""",
+            [[item["name"]] for item in deltas]
+        )
+        _add_to_players(cur, deltas)
+    player_cache.invalidate(*[item["name"] for item in deltas])
+
+
+def _add_to_players(cur: sqlite3.Cursor, deltas: list[dict[str, Any]]) -> None:
+    columns = [column for column in deltas[0].keys() if column != "name"]
+
+    cur.executemany(f"""UPDATE players SET
+                       {', '.join([f'{column} = COALESCE({column}, 0) + ?' for column in columns])}
+                       WHERE name = ?""",
+                    [[item[column] for column in columns] + [item["name"]] for item in deltas])
+
+
+def get_leaderboard(order: str, limit: int) -> list[dict]:
+    """Returns the top `limit` players by the `order` score, reading only that many entries of its index."""
+    score = LEADERBOARD_SCORES[order]
+
+    with pool.connection() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT * FROM players")
+        cur.execute(f"SELECT name, {score} FROM players ORDER BY {score} DESC, name LIMIT ?", [limit])
         res = cur.fetchall()
 
-    conn.close()
-    return res
+    return [{"rank": rank, "name": name, "score": value} for rank, (name, value) in enumerate(res, start=1)]
+
+
+def get_rank(name: str, order: str) -> dict | None:
+    """Returns the place of the player in the `order` leaderboard, None for an unknown player.
+
+    The place is the number of index entries in front of the player, so it costs a scan of that part of the index
+    (O(rank)) without touching the table itself. SQLite b-trees keep no counts per subtree, so it cannot be
+    logarithmic; bench_leaderboard.py measures it on a generated database.
+    """
+    score = LEADERBOARD_SCORES[order]
+
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {score} FROM players WHERE name = ?", [name])
+        if (res := cur.fetchone()) is None:
+            return None
+        value = res[0]
+
+        # NULL в SQLite меньше любого значения, поэтому при сортировке по убыванию такие игроки идут последними
+        if value is None:
+            cur.execute(f"""SELECT (SELECT COUNT(*) FROM players WHERE {score} IS NOT NULL)
+                                 + (SELECT COUNT(*) FROM players WHERE {score} IS NULL AND name < ?)""", [name])
+        else:
+            cur.execute(f"""SELECT (SELECT COUNT(*) FROM players WHERE {score} > ?)
+                                 + (SELECT COUNT(*) FROM players WHERE {score} = ? AND name < ?)""",
+                        [value, value, name])
+        ahead = cur.fetchone()[0]
+
+    return {"rank": ahead + 1, "name": name, "score": value}
 
 
-def add_to_player(name: str, **kwargs) -> None:
-    player = get_player(name)
-    for key, value in kwargs.items():
-        player[key] += value
-    update_player(**player)
+def get_pdf_job(key: str) -> dict | None:
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT status, error, size, used FROM pdf_jobs WHERE key = ?", [key])
+        res = cur.fetchone()
+
+    return None if res is None else dict(zip(["status", "error", "size", "used"], res))
+
+
+def claim_pdf_job(key: str, stale_before: float) -> bool:
+    """Queues the job unless it is done or some process is already on it; True if the caller should render it.
+
+    A queued or running job not updated since `stale_before` is taken over: the process that had it is gone.
+    """
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """INSERT INTO pdf_jobs (key, status, used) VALUES (?, 'queued', ?)
+             ON CONFLICT (key) DO UPDATE SET status = 'queued', error = NULL, size = NULL, used = excluded.used
+             WHERE status = 'failed' OR (status IN ('queued', 'running') AND used < ?)""",
+            [key, time.time(), stale_before]
+        )
+        return cur.rowcount == 1
+
+
+def set_pdf_job(key: str, status: str, error: str | None = None, size: int | None = None) -> None:
+    with pool.connection() as conn:
+        conn.execute("UPDATE pdf_jobs SET status = ?, error = ?, size = ?, used = ? WHERE key = ?",
+                     [status, error, size, time.time(), key])
+
+
+def add_pdf_jobs(done: list[tuple[str, int, float]]) -> None:
+    """Records reports found on disk as `(key, size, used)` unless their jobs are already known."""
+    with pool.connection() as conn:
+        conn.executemany("INSERT OR IGNORE INTO pdf_jobs (key, status, size, used) VALUES (?, 'done', ?, ?)", done)
+
+
+def touch_pdf_job(key: str) -> None:
+    with pool.connection() as conn:
+        conn.execute("UPDATE pdf_jobs SET used = ? WHERE key = ?", [time.time(), key])
+
+
+def delete_pdf_job(key: str) -> None:
+    with pool.connection() as conn:
+        conn.execute("DELETE FROM pdf_jobs WHERE key = ?", [key])
+
+
+def evict_pdf_jobs(cache_bytes: int, history: int) -> list[str]:
+    """Forgets the least recently used reports beyond `cache_bytes` and the failed jobs beyond the last `history`.
+
+    Returns the keys of the forgotten reports, whose files the caller deletes. The last used report is always kept.
+    """
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """SELECT key FROM (
+                 SELECT key, SUM(size) OVER (ORDER BY used DESC) AS total, ROW_NUMBER() OVER (ORDER BY used DESC) AS n
+                 FROM pdf_jobs WHERE status = 'done')
+             WHERE total > ? AND n > 1""",
+            [cache_bytes]
+        )
+        evicted = [key for key, in cur.fetchall()]
+        cur.executemany("DELETE FROM pdf_jobs WHERE key = ?", [[key] for key in evicted])
+        cur.execute(
+            """DELETE FROM pdf_jobs WHERE status = 'failed' AND key NOT IN (
+                 SELECT key FROM pdf_jobs WHERE status = 'failed' ORDER BY used DESC LIMIT ?)""",
+            [history]
+        )
+
+    return evicted
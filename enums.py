@@ -18,3 +18,9 @@ class ActionsEnum(str, Enum):
     SHOW_MAFIA = "SHOW_MAFIA"
     KILL = "KILL"
     CHECK = "CHECK"
+
+
+class AudienceEnum(str, Enum):
+    ALL = "ALL"
+    MAFIA = "MAFIA"
+    COP = "COP"
@@ -0,0 +1,68 @@
+import time
+from collections.abc import Callable, Iterable
+from concurrent import futures
+from functools import partial
+from logging import getLogger
+from typing import Protocol, TypeVar
+
+
+class Recipient(Protocol):
+    name: str
+
+
+R = TypeVar("R", bound=Recipient)
+
+
+class NotStartedError(TimeoutError):
+    """The call never started: the pool was busy with other recipients until the deadline, or was shut down."""
+
+
+class FanOut:
+    """Sends one call to many clients in parallel on a bounded thread pool, without making the caller wait.
+
+    All calls of one `send` share a single deadline: a call gets only the time left until it, and a call that is
+    still queued when it passes is not made at all, so a slow client holds a pool thread for at most `timeout`
+    seconds no matter how many recipients there are.
+    """
+
+    def __init__(self, max_workers: int, timeout: float):
+        self.executor = futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout")
+        self.timeout = timeout
+
+        self.logger = getLogger(__name__)
+
+    def send(
+            self, recipients: Iterable[R], call: Callable[[R, float], None],
+            on_result: Callable[[R, BaseException | None], None]
+    ) -> None:
+        """Starts `call(recipient, timeout)` for every recipient and returns at once.
+
+        `on_result(recipient, exception)` runs on a pool thread as each call ends, with None for a successful one.
+        """
+        deadline = time.monotonic() + self.timeout
+
+        for recipient in recipients:
+            future = self.executor.submit(self._call_before_deadline, call, recipient, deadline)
+            future.add_done_callback(partial(self._finish, recipient, on_result))
+
+    def _finish(self, recipient: R, on_result: Callable[[R, BaseException | None], None], future: futures.Future) -> None:
+        # Отменяются только задачи, ещё стоявшие в очереди пула при его остановке
+        exception = NotStartedError("Fan-out was shut down") if future.cancelled() else future.exception()
+        if exception is not None:
+            self.logger.warning("Failed to notify %s: %r", recipient.name, exception)
+
+        try:
+            on_result(recipient, exception)
+        except Exception:
+            self.logger.exception("Failed to handle the result for %s", recipient.name)
+
+    @staticmethod
+    def _call_before_deadline(call: Callable[[R, float], None], recipient: R, deadline: float) -> None:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            raise NotStartedError("Deadline exceeded in queue")
+
+        call(recipient, timeout)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
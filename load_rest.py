@@ -0,0 +1,117 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from collections.abc import Callable
+from multiprocessing import Pool
+from urllib.parse import quote, urlsplit
+
+
+def send(conn: http.client.HTTPConnection, method: str, path: str, body: dict | None = None) -> tuple[int, bytes]:
+    if body is None:
+        conn.request(method, path)
+    else:
+        conn.request(method, path, json.dumps(body), {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def get(conn: http.client.HTTPConnection, path: str) -> tuple[int, bytes]:
+    return send(conn, "GET", path)
+
+
+# Запросы каждой нагрузки; одна выбирается случайно на каждый запрос
+MIXES: dict[str, list[Callable[[list[str]], tuple[str, str, dict | None]]]] = {
+    "reads": [
+        lambda names: ("GET", f"/players/{quote(random.choice(names))}", None),
+        lambda names: ("GET", f"/players?limit=50&after={quote(random.choice(names))}", None),
+        lambda names: ("GET", "/leaderboard?limit=10", None),
+    ],
+    "get": [lambda names: ("GET", f"/players/{quote(random.choice(names))}", None)],
+    "patch": [lambda names: ("PATCH", f"/players/{quote(random.choice(names))}", {"age": random.randint(1, 99)})],
+}
+
+
+def run(url: str, names: list[str], mix: str, concurrency: int, duration: float) -> tuple[list[float], int]:
+    """Sends the requests of `mix` for random `names` to `url` from `concurrency` keep-alive connections.
+
+    Returns the latencies of all requests and the number of failed ones.
+    """
+    latencies: list[float] = []
+    errors: list[str] = []
+    stop = threading.Event()
+
+    def user() -> None:
+        parts = urlsplit(url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                status, _ = send(conn, *random.choice(MIXES[mix])(names))
+                if status >= 400:
+                    errors.append(str(status))
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(type(e).__name__)
+                conn.close()  # Следующий запрос откроет соединение заново
+            latencies.append(time.perf_counter() - start)  # list.append атомарен, лок не нужен
+        conn.close()
+
+    threads = [threading.Thread(target=user) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return latencies, len(errors)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local load on the REST servers, one run per url")
+    parser.add_argument("urls", nargs="+", help="for example http://127.0.0.1:8001 http://127.0.0.1:8002")
+    parser.add_argument("--mix", choices=MIXES, default="reads", help="reads: profiles, pages and the leaderboard; "
+                                                                       "get: GET /players/<name>; "
+                                                                       "patch: PATCH /players/<name>")
+    parser.add_argument("--seed", type=int, default=0, help="add this many players through POST /players/<name> "
+                                                            "first and load only them; works with older servers "
+                                                            "too, whose GET /players is not JSON")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--processes", type=int, default=4, help="the load is split between processes, so that "
+                                                                  "the client itself is not held back by the GIL")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per url")
+    args = parser.parse_args()
+
+    # Имена для запросов берём у первого сервера: базу они делят
+    parts = urlsplit(args.urls[0])
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    if args.seed:
+        names = [f"load-{i}" for i in range(args.seed)]
+        for name in names:
+            send(conn, "POST", f"/players/{name}", {"age": 20})  # Уже добавленный игрок не меняется
+    else:
+        status, body = get(conn, "/players?limit=1000")
+        names = [player["name"] for player in json.loads(body)["players"]] if status == 200 else []
+    conn.close()
+    if not names:
+        raise SystemExit("No players in the database, add some first")
+
+    with Pool(args.processes) as pool:
+        for url in args.urls:
+            concurrency = max(args.concurrency // args.processes, 1)
+            runs = pool.starmap(run, [(url, names, args.mix, concurrency, args.duration)] * args.processes)
+            latencies = sorted(latency for run_latencies, _ in runs for latency in run_latencies)
+            errors = sum(run_errors for _, run_errors in runs)
+            if not latencies:
+                print(f"{url}: no requests completed, errors {errors}", flush=True)
+                continue
+
+            print(f"{url} {args.mix} c={args.concurrency}: {len(latencies) / args.duration:.0f} req/s, "
+                  f"p50 {latencies[len(latencies) // 2] * 1e3:.1f} ms, "
+                  f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.1f} ms, errors {errors}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import atexit
+import logging
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from threading import Lock
+
+from settings import settings
+
+_listener: QueueListener | None = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `burst` identical records per `interval` seconds.
+
+    Records are identical when they come from the same call site with the same message and arguments, so a flood
+    of one repeating error is cut while different messages from one place (game events, say) all get through. The
+    records over the limit are dropped before they are formatted, and their number is added to the next identical
+    record that passes.
+    """
+
+    def __init__(self, interval: float, burst: int):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+
+        # [начало окна, пропущено, отброшено]
+        self.key_2_window: dict[tuple[str, int, str, str], list[float | int]] = {}
+        self.swept = time.monotonic()
+        self.lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        # repr, а не сами аргументы: они бывают нехешируемыми
+        key = (record.pathname, record.lineno, str(record.msg), repr(record.args))
+
+        with self.lock:
+            if now - self.swept >= self.interval:
+                # Разных сообщений неограниченно много; кончившееся окно нужно хранить, только пока за ним
+                # числятся отброшенные записи
+                self.key_2_window = {
+                    key: window for key, window in self.key_2_window.items()
+                    if now - window[0] < self.interval or window[2]
+                }
+                self.swept = now
+
+            window = self.key_2_window.setdefault(key, [now, 0, 0])
+            if now - window[0] >= self.interval:
+                window[0], window[1] = now, 0
+
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} [{suppressed} identical messages suppressed]"
+            record.args = None
+
+        return True
+
+
+def setup_logging() -> QueueListener:
+    """Sends all records through a queue to a background thread that writes them, with levels from settings.
+
+    Callers only check the level and the rate limit and put the record on the queue, so a slow stderr never blocks
+    a gRPC or request thread. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(settings.LOG_FORMAT))
+
+    queue: SimpleQueue[logging.LogRecord] = SimpleQueue()
+    queue_handler = QueueHandler(queue)
+    queue_handler.addFilter(RateLimitFilter(settings.LOG_RATE_LIMIT_INTERVAL, settings.LOG_RATE_LIMIT_BURST))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(settings.LOG_LEVEL)
+    for name, level in settings.LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(queue, handler)
+    _listener.start()
+    atexit.register(_listener.stop)  # Дописываем то, что осталось в очереди
+
+    return _listener
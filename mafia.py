@@ -1,35 +1,124 @@
 import time
-from collections.abc import Generator
+from array import array
+from collections.abc import Callable
 from dataclasses import dataclass
 from uuid import UUID, uuid4
 
-from enums import ActionsEnum, DayOfTimeEnum, RoleEnum
+from enums import ActionsEnum, AudienceEnum, DayOfTimeEnum, RoleEnum
 from settings import roles_config
 from random import shuffle
 
-from threading import Lock
+from threading import RLock
 
 from logging import getLogger
 
+logger = getLogger(__name__)
 
-@dataclass
+ROLES: list[RoleEnum | None] = [None, *RoleEnum]  # Код роли в Game.roles - индекс в этом списке, 0 - роли ещё нет
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+ACTION_BITS = {action: 1 << bit for bit, action in enumerate(ActionsEnum)}
+TARGETED_ACTIONS = {ActionsEnum.VOTE, ActionsEnum.KILL, ActionsEnum.CHECK}
+
+# Действия, которые фаза даёт каждой роли; SHOW_MAFIA комиссар получает днём, только если нашёл мафию
+PHASE_ROLE_ACTIONS: dict[DayOfTimeEnum, dict[RoleEnum, int]] = {
+    DayOfTimeEnum.DAY: {role: ACTION_BITS[ActionsEnum.SLEEP] | ACTION_BITS[ActionsEnum.VOTE] for role in RoleEnum},
+    DayOfTimeEnum.NIGHT: {
+        RoleEnum.CIVILIAN: 0,
+        RoleEnum.MAFIA: ACTION_BITS[ActionsEnum.KILL],
+        RoleEnum.COP: ACTION_BITS[ActionsEnum.CHECK],
+    },
+}
+
+
+@dataclass(slots=True)
 class Player:
+    """Snapshot of one seat of a game, built from the packed game state on demand."""
     name: str
     role: RoleEnum | None = None
     alive: bool = True
     asleep: bool = False
 
 
+class VoteTally:
+    """Votes of one phase by seat, with the leader kept up to date on every vote.
+
+    Votes only grow by one, so a vote either makes its target the only leader, ties it with the leader or changes
+    nothing at the top, and both the leader and the tie are known in O(1) at any moment of the phase.
+    """
+
+    __slots__ = ("counts", "leader", "leader_votes", "tied")
+
+    def __init__(self, seats: int):
+        self.counts = array("H", bytes(2 * seats))
+        self.leader: int = -1
+        self.leader_votes: int = 0
+        self.tied: bool = False
+
+    def add(self, seat: int) -> int:
+        votes = self.counts[seat] = self.counts[seat] + 1
+
+        if votes > self.leader_votes:
+            self.leader, self.leader_votes, self.tied = seat, votes, False
+        elif votes == self.leader_votes and seat != self.leader:
+            self.tied = True
+
+        return votes
+
+    @property
+    def winner(self) -> int:
+        """The only leader, -1 if nobody voted or the lead is tied."""
+        return -1 if self.tied else self.leader
+
+
+@dataclass(slots=True, frozen=True)
+class Event:
+    """Message produced by an action, with the group of players allowed to see it."""
+    text: str
+    audience: AudienceEnum = AudienceEnum.ALL
+
+
 class Game:
-    def __init__(self, id: UUID, amount_of_players_to_start: int = 4):
+    """State of one game, packed by seat.
+
+    A player is a seat number, the index of their name in `names`. Per-seat flags are bits of the `*_mask` ints,
+    roles and taken actions are byte arrays, votes are fixed-size counters reset every phase. `available` holds the
+    actions each seat can still take, rebuilt on phase changes and patched by every action and death.
+
+    Actions go through `apply_action`, a state machine driven by the PHASE_ACTIONS and PHASE_ENDS tables. The state
+    is plain data, so a game can be pickled between actions.
+    """
+
+    __slots__ = (
+        "id", "on_update", "time_start", "time_end",
+        "names", "seat_of", "roles", "actions", "available", "civilian_votes", "mafia_votes",
+        "alive_mask", "asleep_mask", "done_mask", "mafia_mask", "cop_seat", "found_mafia_seat",
+        "time_of_day", "_is_first_day", "started", "finished", "amount_of_players_to_start",
+        "notifications", "lock",
+    )
+
+    def __init__(
+            self, id: UUID, amount_of_players_to_start: int = 4, on_update: Callable[["Game"], None] | None = None
+    ):
         self.id = id
+        self.on_update = on_update
 
         self.time_start: float = time.time()
         self.time_end: float | None = None
 
-        self.name_2_player: dict[str, Player] = {}
-        self.name_2_mafia_player: dict[str, Player] = {}
-        self.cop_player: Player | None = None
+        self.names: list[str] = []
+        self.seat_of: dict[str, int] = {}
+        self.roles = bytearray()
+        self.actions = bytearray()  # Битовые маски ACTION_BITS уже сделанных за фазу действий
+        self.available = bytearray()  # Битовые маски ACTION_BITS действий, которые ещё можно сделать
+        self.civilian_votes = VoteTally(0)
+        self.mafia_votes = VoteTally(0)
+
+        self.alive_mask: int = 0
+        self.asleep_mask: int = 0
+        self.done_mask: int = 0
+        self.mafia_mask: int = 0
+        self.cop_seat: int = -1
+        self.found_mafia_seat: int = -1
 
         self.time_of_day: DayOfTimeEnum | None = None
         self._is_first_day: bool = True
@@ -37,72 +126,142 @@ class Game:
         self.finished: bool = False
 
         self.amount_of_players_to_start: int = amount_of_players_to_start
-        self.amount_of_alive_civilian_players: int | None = None
-        self.amount_of_alive_mafia_players: int | None = None
-        self.amount_of_done_players: int = 0
-
-        self.civilian_votes: dict[str, int] = {}
-        self.mafia_votes: dict[str, int] = {}
-
-        self.name_2_actions: dict[str, set[ActionsEnum]] = {}
-        self.found_mafia: Player | None = None
 
         self.notifications: list[str] = []
 
-        self.add_player_action_generator_instance = self._add_player_action_generator()
-        self.add_player_action_generator_instance.send(None)
+        self.lock = RLock()  # Захватывается всеми методами, меняющими состояние игры
 
-        self.lock = Lock()
+        logger.info("New game with id %s was created", self.id)
 
-        self.logger = getLogger(__name__)
+    def __getstate__(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot not in ("on_update", "lock")}
 
-        self.logger.info(f"New game with id {self.id} was created")
+    def __setstate__(self, state: dict) -> None:
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self.on_update = None
+        self.lock = RLock()
 
     @property
     def ready_to_start(self) -> bool:
-        return len(self.name_2_player) >= self.amount_of_players_to_start and not self.started and not self.finished
+        return len(self.names) >= self.amount_of_players_to_start and not self.started and not self.finished
+
+    @property
+    def has_free_seats(self) -> bool:
+        return not self.started and len(self.names) < self.amount_of_players_to_start
+
+    @property
+    def amount_of_alive_mafia_players(self) -> int:
+        return (self.alive_mask & self.mafia_mask).bit_count()
+
+    @property
+    def amount_of_alive_civilian_players(self) -> int:
+        return (self.alive_mask & ~self.mafia_mask).bit_count()
+
+    @property
+    def mafia_names(self) -> list[str]:
+        return [name for seat, name in enumerate(self.names) if self.mafia_mask >> seat & 1]
+
+    @property
+    def cop_name(self) -> str | None:
+        return self.names[self.cop_seat] if self.cop_seat >= 0 else None
+
+    def players(self) -> list[Player]:
+        return [
+            Player(
+                name=name,
+                role=ROLES[self.roles[seat]] if self.roles else None,
+                alive=bool(self.alive_mask >> seat & 1),
+                asleep=bool(self.asleep_mask >> seat & 1),
+            )
+            for seat, name in enumerate(self.names)
+        ]
+
+    def role_of(self, name: str) -> RoleEnum | None:
+        return ROLES[self.roles[self.seat_of[name]]] if self.roles else None
+
+    def is_alive(self, name: str) -> bool:
+        return bool(self.alive_mask >> self.seat_of[name] & 1)
 
     def add_player(self, name: str) -> bool:
         with self.lock:
-            if self.started or len(self.name_2_player) >= self.amount_of_players_to_start:
+            if not self.has_free_seats:
                 return False
 
-            self.name_2_player[name] = Player(name=name)
+            self.seat_of[name] = len(self.names)
+            self.alive_mask |= 1 << len(self.names)
+            self.names.append(name)
 
-            self.logger.info(f"Player with name {name} was added")
+            logger.info("Player with name %s was added", name)
+
+        self._notify_update()
+
+        return True
+
+    def remove_player(self, name: str) -> bool:
+        with self.lock:
+            if self.started or name not in self.seat_of:
+                return False
+
+            # Места сдвигаются; новый список, а не правка на месте, чтобы не ломать идущие по старому обходы
+            self.names = [other for other in self.names if other != name]
+            self.seat_of = {other: seat for seat, other in enumerate(self.names)}
+            self.alive_mask = (1 << len(self.names)) - 1
+
+            logger.info("Player with name %s was removed", name)
 
             return True
 
+    def leave(self, name: str) -> bool:
+        """Takes a leaving player out of the lobby or, once the game has started, kills them.
+
+        Returns True if a lobby seat was freed.
+        """
+        # Одним захватом лока, иначе игра могла бы начаться между проверкой started и удалением
+        with self.lock:
+            if name not in self.seat_of:
+                return False
+            if not self.started:
+                return self.remove_player(name)
+
+            self.kill_player(name)
+            return False
+
     def start_game(self) -> bool:
+        with self.lock:
+            return self._start_game()
+
+    def _start_game(self) -> bool:
         if self.started or not self.ready_to_start:
             return False
 
         self.started = True
 
         roles = []
-        for role, amount in roles_config[len(self.name_2_player)].items():
+        for role, amount in roles_config[len(self.names)].items():
             roles.extend([role] * amount)
         shuffle(roles)
 
-        for player, role in zip(self.name_2_player.values(), roles):
-            player.role = role
-
+        self.roles = bytearray(ROLE_CODES[role] for role in roles)
+        for seat, role in enumerate(roles):
             if role == RoleEnum.MAFIA:
-                self.name_2_mafia_player[player.name] = player
+                self.mafia_mask |= 1 << seat
 
             elif role == RoleEnum.COP:
-                self.cop_player = player
+                self.cop_seat = seat
 
-        self.amount_of_alive_mafia_players = roles_config[len(self.name_2_player)][RoleEnum.MAFIA]
-        self.amount_of_alive_civilian_players = len(self.name_2_player) - self.amount_of_alive_mafia_players
+        self._refresh()
 
-        self.logger.info(f"Game with id {self.id} started, players are: {self.name_2_player.values()}")
+        logger.info("Game with id %s started, players are: %s", self.id, self.names)
 
         self._day_actions()
 
         return True
 
     def check_game_end(self) -> RoleEnum | None:
+        if not self.started:
+            return None
+
         if self.amount_of_alive_mafia_players == 0:
             res = RoleEnum.CIVILIAN
         elif self.amount_of_alive_mafia_players == self.amount_of_alive_civilian_players:
@@ -117,119 +276,157 @@ class Game:
 
         return res
 
+    def available_actions_mask(self, name: str) -> int:
+        """ACTION_BITS of the actions the player can take now; cheap enough to poll on every tick."""
+        seat = self.seat_of[name]
+        return self.available[seat] if seat < len(self.available) else 0
+
     def get_available_actions_for_player(self, name: str) -> list[ActionsEnum]:
-        with self.lock:
-            actions = set()
+        mask = self.available_actions_mask(name)
+        return [action for action, bit in ACTION_BITS.items() if mask & bit]
 
-            if not self.name_2_player[name].alive or self.finished:
-                return list(actions)
+    def _update_available(self) -> None:
+        if not self.started or self.finished:
+            self.available = bytearray(len(self.names))
+            return
 
-            if self.time_of_day == DayOfTimeEnum.DAY:
-                actions.update([ActionsEnum.SLEEP, ActionsEnum.VOTE])
+        role_actions = PHASE_ROLE_ACTIONS[self.time_of_day]
+        available = bytearray(len(self.names))
+        for seat in range(len(self.names)):
+            if self.alive_mask >> seat & 1:
+                available[seat] = role_actions[ROLES[self.roles[seat]]] & ~self.actions[seat]
 
-                if self.found_mafia is not None and self.cop_player.name == name:
-                    actions.add(ActionsEnum.SHOW_MAFIA)
-            else:
-                if name in self.name_2_mafia_player:
-                    actions.add(ActionsEnum.KILL)
-                elif self.cop_player is not None and name == self.cop_player.name:
-                    actions.add(ActionsEnum.CHECK)
-            self.logger.info(actions)
-            self.logger.info(self.name_2_actions.get(name))
-            self.logger.info(self.name_2_player)
-            self.logger.info(self.finished)
-            self.logger.info(list(actions - (self.name_2_actions.get(name) or set())))
-            self.logger.info('\n\n')
-            return list(actions - (self.name_2_actions.get(name) or set()))
+        if self.time_of_day == DayOfTimeEnum.DAY and self.found_mafia_seat >= 0 and self.alive_mask >> self.cop_seat & 1:
+            available[self.cop_seat] |= ACTION_BITS[ActionsEnum.SHOW_MAFIA] & ~self.actions[self.cop_seat]
+
+        self.available = available
+
+    def vote_leader_message(self) -> str:
+        """Who currently leads the day vote."""
+        with self.lock:
+            votes = self.civilian_votes
+            if votes.leader < 0:
+                return "Nobody has votes yet"
+            if votes.tied:
+                return f"Vote is tied at {votes.leader_votes} votes"
+            return f"{self.names[votes.leader]} leads with {votes.leader_votes} votes"
 
     def get_and_delete_notifications(self) -> list[str]:
-        notifications = self.notifications.copy()
-        self.notifications = []
-        return notifications
+        with self.lock:
+            notifications = self.notifications.copy()
+            self.notifications = []
+            return notifications
 
     def kill_player(self, name: str) -> None:
-        if name in self.name_2_mafia_player:
-            self.amount_of_alive_mafia_players -= 1
-        else:
-            self.amount_of_alive_civilian_players -= 1
+        """Kills a player who left the game, finishing the phase if the others were only waiting for them."""
+        with self.lock:
+            seat = self.seat_of[name]
+            if not self.alive_mask >> seat & 1:
+                return
+
+            self._kill_player(seat)
 
-        self.name_2_player[name].alive = False
+            if not self.finished:
+                self._finish_phase_if_everyone_is_done()
 
-        self.notifications.append(f"{name} was killed by mafia")
+    def _kill_player(self, seat: int) -> None:
+        if not self.alive_mask >> seat & 1:
+            return
+
+        self.alive_mask &= ~(1 << seat)
+        self.available[seat] = 0
+
+        self.notifications.append(f"{self.names[seat]} was killed by mafia")
 
         winner_team = self.check_game_end()
         if winner_team is not None:
+            self._update_available()
             self.notifications.append(f"{winner_team} won the game with id {self.id}")
 
-    def _get_player_name_with_most_votes(self) -> str | None:
-        if not self.civilian_votes:
-            return None
+    def _notify_update(self) -> None:
+        if self.on_update is not None:
+            self.on_update(self)
 
-        sorted_votes = sorted(self.civilian_votes.items(), key=lambda x: x[1], reverse=True)
+    def apply_action(self, name: str, action: ActionsEnum, target_name: str | None = None) -> list[Event]:
+        """Applies one action of a player and returns what should be told about it.
 
-        if len(sorted_votes) == 1:
-            return sorted_votes[0][0]
+        Raises ValueError if the action is not available to the player or its target is not in the game. Messages
+        about the end of the phase the action may cause are queued to `notifications` as before.
+        """
+        with self.lock:
+            available = self.get_available_actions_for_player(name)
+            if action not in available:
+                raise ValueError(f"Action is not available. Available actions: {available}")
 
-        if sorted_votes[0][1] == sorted_votes[1][1]:
-            return None
+            target = self.seat_of.get(target_name, -1)
+            if action in TARGETED_ACTIONS and target < 0:
+                raise ValueError(f"No player {target_name} in the game")
 
-        return sorted_votes[0][0]
+            seat = self.seat_of[name]
+            self.actions[seat] |= ACTION_BITS[action]
+            self.available[seat] &= ~ACTION_BITS[action]
 
-    def _add_player_action_generator(self) -> Generator[str, [str, ActionsEnum, str | None]]:  # Действия поприменяются в виде генератора,
-        while True:                                                                            # так как от них требуется мгновенный ответ,
-            name, action, target_name = yield                                                  # от которого теоретически будет зависеть ход
-                                                                                               # другого игрока
-            player = self.name_2_player[name]
+            events = PHASE_ACTIONS[self.time_of_day][action](self, seat, target)
 
-            self.name_2_actions[name] = self.name_2_actions.get(name, set()) | {action}
+            self._finish_phase_if_everyone_is_done()
 
-            if action == ActionsEnum.SLEEP:
-                player.asleep = True
-                self.amount_of_done_players += 1
+            return events
 
-                yield f"Player {name} goes to sleep"
-            elif action == ActionsEnum.VOTE:
-                self.civilian_votes[target_name] = self.civilian_votes.get(target_name, 0) + 1
+    def _sleep(self, seat: int, target: int) -> list[Event]:
+        self.asleep_mask |= 1 << seat
+        self.done_mask |= 1 << seat
 
-                yield f"Player {name} voted for {target_name}. {target_name} now has {self.civilian_votes[target_name]} votes"
-            elif action == ActionsEnum.SHOW_MAFIA:
-                yield f"Cop {name} found mafia: {self.found_mafia.name}"
-            elif action == ActionsEnum.KILL:
-                self.mafia_votes[target_name] = self.mafia_votes.get(target_name, 0) + 1
-                self.amount_of_done_players += 1
+        return [Event(f"Player {self.names[seat]} goes to sleep")]
 
-                yield f"Mafia {name} want to kill {target_name} this night"
-            else:
-                self.amount_of_done_players += 1
+    def _vote(self, seat: int, target: int) -> list[Event]:
+        votes = self.civilian_votes.add(target)
 
-                if target_name in self.name_2_mafia_player:
-                    self.found_mafia = self.name_2_mafia_player[target_name]
+        target_name = self.names[target]
+        return [Event(f"Player {self.names[seat]} voted for {target_name}. "
+                      f"{target_name} now has {votes} votes. {self.vote_leader_message()}")]
 
-                    yield f"{target_name} is mafia"
-                else:
-                    yield f"{target_name} is not mafia"
+    def _show_mafia(self, seat: int, target: int) -> list[Event]:
+        return [Event(f"Cop {self.names[seat]} found mafia: {self.names[self.found_mafia_seat]}")]
 
-            if self.time_of_day == DayOfTimeEnum.DAY:
-                if self.amount_of_done_players == self.amount_of_alive_mafia_players + self.amount_of_alive_civilian_players:
-                    self._night_actions()
-            else:
-                if self.amount_of_done_players == self.amount_of_alive_mafia_players + self.cop_player.alive:
-                    self._day_actions()
+    def _kill(self, seat: int, target: int) -> list[Event]:
+        self.mafia_votes.add(target)
+        self.done_mask |= 1 << seat
+
+        return [Event(f"Mafia {self.names[seat]} want to kill {self.names[target]} this night", AudienceEnum.MAFIA)]
+
+    def _check(self, seat: int, target: int) -> list[Event]:
+        self.done_mask |= 1 << seat
+
+        if self.mafia_mask >> target & 1:
+            self.found_mafia_seat = target
+
+            return [Event(f"{self.names[target]} is mafia", AudienceEnum.COP)]
+        return [Event(f"{self.names[target]} is not mafia", AudienceEnum.COP)]
+
+    def _finish_phase_if_everyone_is_done(self) -> None:
+        if self.time_of_day == DayOfTimeEnum.DAY:
+            waiting_for = self.alive_mask
+        else:
+            waiting_for = self.alive_mask & (self.mafia_mask | (1 << self.cop_seat if self.cop_seat >= 0 else 0))
+
+        if self.done_mask & waiting_for == waiting_for:
+            PHASE_ENDS[self.time_of_day](self)
 
     def _refresh(self) -> None:
-        self.amount_of_done_players = 0
+        seats = len(self.names)
 
-        self.civilian_votes = {}
-        self.mafia_votes = {}
+        self.done_mask = 0
 
-        self.name_2_actions = {}
-        self.found_mafia = None
+        self.civilian_votes = VoteTally(seats)
+        self.mafia_votes = VoteTally(seats)
+
+        self.actions = bytearray(seats)
+        self.found_mafia_seat = -1
 
     def _day_actions(self) -> None:
-        self.logger.info(repr(self))
+        logger.debug("Game %s: night is over", self.id)
 
-        for player in self.name_2_player.values():
-            player.asleep = False
+        self.asleep_mask = 0
 
         self.time_of_day = DayOfTimeEnum.DAY
 
@@ -237,21 +434,24 @@ class Game:
             self._is_first_day = False
             self.time_of_day = DayOfTimeEnum.NIGHT
         else:
-            killed_player_name = max(self.mafia_votes.items(), key=lambda x: x[1])[0]
-
-            self.kill_player(killed_player_name)
+            # При ничьей мафия убивает того, кто первым набрал наибольшее число голосов
+            if self.mafia_votes.leader >= 0:
+                self._kill_player(self.mafia_votes.leader)
 
             self._refresh()
 
             self.notifications.append(f"New day started!")
 
+        self._update_available()
+        self._notify_update()
+
     def _night_actions(self) -> None:
-        self.logger.info(repr(self))
+        logger.debug("Game %s: day is over", self.id)
         self.time_of_day = DayOfTimeEnum.NIGHT
-        most_voted_player = self._get_player_name_with_most_votes()
+        most_voted_seat = self.civilian_votes.winner
 
-        if most_voted_player is not None:
-            self.kill_player(most_voted_player)
+        if most_voted_seat >= 0:
+            self._kill_player(most_voted_seat)
 
         else:
             self.notifications.append("No one was killed today")
@@ -260,6 +460,29 @@ class Game:
 
         self.notifications.append(f"New night started!")
 
+        self._update_available()
+        self._notify_update()
+
+
+# Какие действия принимаются в каждой фазе и что они меняют
+PHASE_ACTIONS: dict[DayOfTimeEnum, dict[ActionsEnum, Callable[[Game, int, int], list[Event]]]] = {
+    DayOfTimeEnum.DAY: {
+        ActionsEnum.SLEEP: Game._sleep,
+        ActionsEnum.VOTE: Game._vote,
+        ActionsEnum.SHOW_MAFIA: Game._show_mafia,
+    },
+    DayOfTimeEnum.NIGHT: {
+        ActionsEnum.KILL: Game._kill,
+        ActionsEnum.CHECK: Game._check,
+    },
+}
+
+# Чем заканчивается фаза, когда все, кого она ждёт, сделали ход
+PHASE_ENDS: dict[DayOfTimeEnum, Callable[[Game], None]] = {
+    DayOfTimeEnum.DAY: Game._night_actions,
+    DayOfTimeEnum.NIGHT: Game._day_actions,
+}
+
 
 if __name__ == '__main__':  # for debug purposes
     game = Game(uuid4())
@@ -14,7 +14,7 @@ _sym_db = _symbol_database.Default()
 from google.protobuf import empty_pb2 as google_dot_protobuf_dot_empty__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0c\x63lient.proto\x1a\x1bgoogle/protobuf/empty.proto\"\"\n\x10JoinNotification\x12\x0e\n\x06player\x18\x01 \x01(\t\"#\n\x11LeaveNotification\x12\x0e\n\x06player\x18\x01 \x01(\t\"*\n\x12\x41\x63tionNotification\x12\x14\n\x0cnotification\x18\x01 \x01(\t\"\x14\n\x04Role\x12\x0c\n\x04role\x18\x01 \x01(\t\"#\n\x10\x41vailableActions\x12\x0f\n\x07\x61\x63tions\x18\x01 \x03(\t\"\x0e\n\x0cLivezRequest\"\x0f\n\rLivezResponse2\xdb\x02\n\x06\x43lient\x12\x39\n\nNotifyJoin\x12\x11.JoinNotification\x1a\x16.google.protobuf.Empty\"\x00\x12;\n\x0bNotifyLeave\x12\x12.LeaveNotification\x1a\x16.google.protobuf.Empty\"\x00\x12=\n\x0cNotifyAction\x12\x13.ActionNotification\x1a\x16.google.protobuf.Empty\"\x00\x12+\n\x08SendRole\x12\x05.Role\x1a\x16.google.protobuf.Empty\"\x00\x12\x43\n\x14SendAvailableActions\x12\x11.AvailableActions\x1a\x16.google.protobuf.Empty\"\x00\x12(\n\x05Livez\x12\r.LivezRequest\x1a\x0e.LivezResponse\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0c\x63lient.proto\x1a\x1bgoogle/protobuf/empty.proto\"\"\n\x10JoinNotification\x12\x0e\n\x06player\x18\x01 \x01(\t\"#\n\x11LeaveNotification\x12\x0e\n\x06player\x18\x01 \x01(\t\"*\n\x12\x41\x63tionNotification\x12\x14\n\x0cnotification\x18\x01 \x01(\t\"\x14\n\x04Role\x12\x0c\n\x04role\x18\x01 \x01(\t\"#\n\x10\x41vailableActions\x12\x0f\n\x07\x61\x63tions\x18\x01 \x03(\t\"\xc6\x01\n\x05\x45vent\x12!\n\x04join\x18\x01 \x01(\x0b\x32\x11.JoinNotificationH\x00\x12#\n\x05leave\x18\x02 \x01(\x0b\x32\x12.LeaveNotificationH\x00\x12%\n\x06\x61\x63tion\x18\x03 \x01(\x0b\x32\x13.ActionNotificationH\x00\x12\x15\n\x04role\x18\x04 \x01(\x0b\x32\x05.RoleH\x00\x12.\n\x11\x61vailable_actions\x18\x05 \x01(\x0b\x32\x11.AvailableActionsH\x00\x42\x07\n\x05\x65vent\"$\n\nEventBatch\x12\x16\n\x06\x65vents\x18\x01 \x03(\x0b\x32\x06.Event\"\x0e\n\x0cLivezRequest\"\x0f\n\rLivezResponse2\x91\x03\n\x06\x43lient\x12\x39\n\nNotifyJoin\x12\x11.JoinNotification\x1a\x16.google.protobuf.Empty\"\x00\x12;\n\x0bNotifyLeave\x12\x12.LeaveNotification\x1a\x16.google.protobuf.Empty\"\x00\x12=\n\x0cNotifyAction\x12\x13.ActionNotification\x1a\x16.google.protobuf.Empty\"\x00\x12+\n\x08SendRole\x12\x05.Role\x1a\x16.google.protobuf.Empty\"\x00\x12\x43\n\x14SendAvailableActions\x12\x11.AvailableActions\x1a\x16.google.protobuf.Empty\"\x00\x12\x34\n\x0bNotifyBatch\x12\x0b.EventBatch\x1a\x16.google.protobuf.Empty\"\x00\x12(\n\x05Livez\x12\r.LivezRequest\x1a\x0e.LivezResponse\"\x00\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'client_pb2', globals())
@@ -31,10 +31,14 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   _ROLE._serialized_end=182
   _AVAILABLEACTIONS._serialized_start=184
   _AVAILABLEACTIONS._serialized_end=219
-  _LIVEZREQUEST._serialized_start=221
-  _LIVEZREQUEST._serialized_end=235
-  _LIVEZRESPONSE._serialized_start=237
-  _LIVEZRESPONSE._serialized_end=252
-  _CLIENT._serialized_start=255
-  _CLIENT._serialized_end=602
+  _EVENT._serialized_start=222
+  _EVENT._serialized_end=420
+  _EVENTBATCH._serialized_start=422
+  _EVENTBATCH._serialized_end=458
+  _LIVEZREQUEST._serialized_start=460
+  _LIVEZREQUEST._serialized_end=474
+  _LIVEZRESPONSE._serialized_start=476
+  _LIVEZRESPONSE._serialized_end=491
+  _CLIENT._serialized_start=494
+  _CLIENT._serialized_end=895
 # @@protoc_insertion_point(module_scope)
@@ -40,6 +40,11 @@ class ClientStub(object):
                 request_serializer=client__pb2.AvailableActions.SerializeToString,
                 response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
                 )
+        self.NotifyBatch = channel.unary_unary(
+                '/Client/NotifyBatch',
+                request_serializer=client__pb2.EventBatch.SerializeToString,
+                response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+                )
         self.Livez = channel.unary_unary(
                 '/Client/Livez',
                 request_serializer=client__pb2.LivezRequest.SerializeToString,
@@ -80,6 +85,12 @@ class ClientServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def NotifyBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def Livez(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -114,6 +125,11 @@ def add_ClientServicer_to_server(servicer, server):
                     request_deserializer=client__pb2.AvailableActions.FromString,
                     response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
             ),
+            'NotifyBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.NotifyBatch,
+                    request_deserializer=client__pb2.EventBatch.FromString,
+                    response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
+            ),
             'Livez': grpc.unary_unary_rpc_method_handler(
                     servicer.Livez,
                     request_deserializer=client__pb2.LivezRequest.FromString,
@@ -214,6 +230,23 @@ class Client(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def NotifyBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Client/NotifyBatch',
+            client__pb2.EventBatch.SerializeToString,
+            google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
     @staticmethod
     def Livez(request,
             target,
@@ -2,6 +2,7 @@
 """Client and server classes corresponding to protobuf-defined services."""
 import grpc
 
+from . import client_pb2 as client__pb2
 from google.protobuf import empty_pb2 as google_dot_protobuf_dot_empty__pb2
 from . import server_pb2 as server__pb2
 
@@ -30,6 +31,16 @@ class ServerStub(object):
                 request_serializer=server__pb2.PerformActionRequest.SerializeToString,
                 response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
                 )
+        self.Subscribe = channel.unary_stream(
+                '/Server/Subscribe',
+                request_serializer=server__pb2.SubscribeRequest.SerializeToString,
+                response_deserializer=client__pb2.Event.FromString,
+                )
+        self.IsRegistered = channel.unary_unary(
+                '/Server/IsRegistered',
+                request_serializer=server__pb2.IsRegisteredRequest.SerializeToString,
+                response_deserializer=server__pb2.IsRegisteredResponse.FromString,
+                )
 
 
 class ServerServicer(object):
@@ -53,6 +64,18 @@ class ServerServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def Subscribe(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def IsRegistered(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ServerServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -71,6 +94,16 @@ def add_ServerServicer_to_server(servicer, server):
                     request_deserializer=server__pb2.PerformActionRequest.FromString,
                     response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
             ),
+            'Subscribe': grpc.unary_stream_rpc_method_handler(
+                    servicer.Subscribe,
+                    request_deserializer=server__pb2.SubscribeRequest.FromString,
+                    response_serializer=client__pb2.Event.SerializeToString,
+            ),
+            'IsRegistered': grpc.unary_unary_rpc_method_handler(
+                    servicer.IsRegistered,
+                    request_deserializer=server__pb2.IsRegisteredRequest.FromString,
+                    response_serializer=server__pb2.IsRegisteredResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'Server', rpc_method_handlers)
@@ -131,3 +164,37 @@ class Server(object):
             google_dot_protobuf_dot_empty__pb2.Empty.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Subscribe(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/Server/Subscribe',
+            server__pb2.SubscribeRequest.SerializeToString,
+            client__pb2.Event.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def IsRegistered(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Server/IsRegistered',
+            server__pb2.IsRegisteredRequest.SerializeToString,
+            server__pb2.IsRegisteredResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -1,19 +1,28 @@
-from flask import Flask, abort, request, Response, send_from_directory
-from queue import Queue
+from flask import Flask, abort, jsonify, request, Response, send_from_directory
+import json
 import logging
 import status
-from uuid import uuid4
-import threading
+from logs import setup_logging
 from settings import settings
-from worker import target
+from worker import PdfRenderer, ingest_avatar
 
 import crud
 
 logger = logging.getLogger(__name__)
 
-queue = Queue()
+renderer = PdfRenderer(
+    settings.PDF_WORKERS, settings.PDF_QUEUE_SIZE, settings.PDF_JOBS_HISTORY, settings.PDF_CACHE_SIZE_MB * 2 ** 20,
+    settings.PDF_JOB_TIMEOUT
+)
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = settings.REST_MAX_CONTENT_MB * 2 ** 20
+
+
+def db_error(e: Exception) -> Response:
+    if isinstance(e, crud.PoolTimeoutError):  # База занята, а не сломана: клиенту стоит повторить
+        return Response(str(e), status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+    return Response(str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 @app.get("/players/<string:name>")
@@ -21,24 +30,93 @@ def get_player(name: str):
     try:
         res = crud.get_player(name=name)
     except Exception as e:
-        abort(Response(str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR))
+        abort(db_error(e))
 
     return Response(str(res), status=status.HTTP_200_OK)
 
 
 @app.get("/players")
 def get_players():
+    """JSON pages of players ordered by name, or every matching player as NDJSON with `?format=ndjson`.
+
+    Query parameters: `after` (cursor from the previous page), `limit`, `columns` (comma separated), `min_wins`,
+    `gender`.
+    """
     try:
-        res = crud.get_players()
+        filters = {
+            "after": request.args.get("after"),
+            "columns": request.args["columns"].split(",") if request.args.get("columns") else None,
+            "min_wins": request.args.get("min_wins", type=int),
+            "gender": request.args.get("gender"),
+        }
+        limit = min(request.args.get("limit", settings.PLAYERS_PAGE_SIZE, type=int), settings.PLAYERS_MAX_PAGE_SIZE)
+
+        if request.args.get("format") == "ndjson":
+            players = crud.iter_players(**filters)
+            first = next(players, None)  # Ошибки запроса должны случиться до того, как начнётся ответ
+
+            def generate():
+                if first is not None:
+                    yield json.dumps(first) + "\n"
+                for player in players:
+                    yield json.dumps(player) + "\n"
+
+            return Response(generate(), mimetype="application/x-ndjson")
+
+        players, next_cursor = crud.get_players(max(limit, 1), **filters)
+    except ValueError as e:
+        abort(Response(str(e), status=status.HTTP_400_BAD_REQUEST))
     except Exception as e:
-        abort(Response(str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR))
+        abort(db_error(e))
 
-    return Response(str(res), status=status.HTTP_200_OK)
+    return jsonify({"players": players, "next": next_cursor})
+
+
+@app.get("/leaderboard")
+def get_leaderboard():
+    order = request.args.get("order", "wins")
+    if order not in crud.LEADERBOARD_SCORES:
+        abort(Response(f"Unknown order {order}", status=status.HTTP_400_BAD_REQUEST))
+    limit = min(request.args.get("limit", settings.LEADERBOARD_SIZE, type=int), settings.PLAYERS_MAX_PAGE_SIZE)
+
+    try:
+        res = crud.get_leaderboard(order, max(limit, 1))
+    except Exception as e:
+        abort(db_error(e))
+
+    return jsonify(res)
+
+
+@app.get("/leaderboard/<string:name>")
+def get_rank(name: str):
+    """Place of one player in the leaderboard.
+
+    Counts the players in front of them in the index of the order, so it costs O(rank): tens of milliseconds for a
+    player in the middle of a million (see bench_leaderboard.py), well under one for the top of the table.
+    """
+    order = request.args.get("order", "wins")
+    if order not in crud.LEADERBOARD_SCORES:
+        abort(Response(f"Unknown order {order}", status=status.HTTP_400_BAD_REQUEST))
+
+    try:
+        res = crud.get_rank(name, order)
+    except Exception as e:
+        abort(db_error(e))
+
+    if res is None:
+        abort(Response(f"Player {name} not found", status=status.HTTP_404_NOT_FOUND))
+
+    return jsonify(res)
+
+
+@app.get("/stats/player_cache")
+def get_player_cache_stats():
+    return jsonify(crud.player_cache.stats())
 
 
 @app.post("/players/<string:name>")
 def add_player(name: str):
-    logging.info(f"Add player {name}")
+    logger.info("Add player %s", name)
     data = request.get_json()
 
     try:
@@ -53,9 +131,8 @@ def add_player(name: str):
             gender=data.get("gender")
         )
     except Exception as e:
-        import traceback
-        traceback.print_exception(e)
-        abort(Response(str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR))
+        logger.exception("Failed to add player %s", name)
+        abort(db_error(e))
 
     return Response(status=status.HTTP_200_OK)
 
@@ -72,7 +149,7 @@ def update_player(name: str):
             gender=data.get("gender")
         )
     except Exception as e:
-        abort(Response(str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR))
+        abort(db_error(e))
 
     return Response(status=status.HTTP_200_OK)
 
@@ -82,13 +159,15 @@ def update_avatar(name: str):
     img = request.files.get("avatar")
     avatar = "img.png"
     if img is not None:
-        img.save(f"contents/avatars/{name}.png")
-        avatar = f"{name}.png"
+        try:
+            avatar = ingest_avatar(name, img.stream)
+        except ValueError as e:
+            abort(Response(str(e), status=status.HTTP_400_BAD_REQUEST))
 
     try:
         crud.update_player(name, avatar=avatar)
     except Exception as e:
-        abort(Response(str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR))
+        abort(db_error(e))
 
     return Response(status=status.HTTP_200_OK)
 
@@ -98,23 +177,69 @@ def add_to_player(name: str):
     data = request.get_json()
 
     try:
-        crud.add_to_player(
+        res = crud.add_to_player(
             name,
             wins=data.get("wins"),
             losses=data.get("losses"),
             time_played=data.get("time_played")
         )
+    except ValueError as e:
+        abort(Response(str(e), status=status.HTTP_400_BAD_REQUEST))
     except Exception as e:
-        abort(Response(str(e), status=status.HTTP_500_INTERNAL_SERVER_ERROR))
+        abort(db_error(e))
+
+    return Response(str(res), status=status.HTTP_200_OK)
+
+
+@app.post("/games/results")
+def add_game_results():
+    data = request.get_json()
+    games = data if isinstance(data, list) else [data]
+
+    try:
+        crud.add_game_results(games)
+    except (KeyError, TypeError) as e:
+        abort(Response(f"Bad game results: {e!r}", status=status.HTTP_400_BAD_REQUEST))
+    except Exception as e:
+        abort(db_error(e))
 
     return Response(status=status.HTTP_200_OK)
 
 
 @app.post("/pdfs/<string:name>")
 def post_task(name: str):
-    id = uuid4()
-    queue.put((id, name))
-    return Response(f"Link to get pdf: http://127.0.0.1:{settings.REST_PORT}/pdfs/{id}.pdf", status=status.HTTP_200_OK)
+    try:
+        data = crud.get_player(name)
+    except Exception as e:
+        abort(db_error(e))
+
+    try:
+        id = renderer.submit(name, data)
+    except Exception as e:
+        abort(db_error(e))
+    if id is None:
+        abort(Response("Too many pdfs in progress, try again later", status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                       headers={"Retry-After": "1"}))
+
+    return Response(
+        f"Link to get pdf: http://127.0.0.1:{settings.REST_PORT}/pdfs/{id}.pdf\n"
+        f"Link to check its status: http://127.0.0.1:{settings.REST_PORT}/pdfs/jobs/{id}",
+        status=status.HTTP_202_ACCEPTED
+    )
+
+
+@app.get("/pdfs/jobs/<string:id>")
+def get_task(id: str):
+    try:
+        res = renderer.status(id)
+    except Exception as e:
+        abort(db_error(e))
+    if res is None:
+        abort(Response(f"Job {id} not found", status=status.HTTP_404_NOT_FOUND))
+
+    if res["status"] == "done":
+        res["link"] = f"http://127.0.0.1:{settings.REST_PORT}/pdfs/{id}.pdf"
+    return jsonify(res)
 
 
 @app.get("/pdfs/<path:path>")
@@ -123,11 +248,11 @@ def get_pdf(path: str):
 
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
+    setup_logging()
     logger.info("Starting rest server")
 
     crud.init_db()
-    worker_thread = threading.Thread(target=target, args=[queue])
-    worker_thread.start()
-    app.run(host="0.0.0.0", port=settings.REST_PORT)
-    worker_thread.join()
+    try:
+        app.run(host="0.0.0.0", port=settings.REST_PORT)
+    finally:
+        renderer.shutdown()
@@ -0,0 +1,162 @@
+from concurrent import futures
+from logging import getLogger
+from threading import BoundedSemaphore, Lock
+from uuid import uuid4
+
+import grpc
+
+from logs import setup_logging
+from python_proto import server_pb2, server_pb2_grpc
+from settings import settings
+from sharding import HashRing
+
+
+class RouterServicer(server_pb2_grpc.ServerServicer):
+    """Thin front for a sharded deployment.
+
+    Seats new clients into a lobby, sends them to the shard that owns the lobby's game id on the hash ring
+    and forwards every later call of the client to that shard.
+    """
+
+    def __init__(self, shards: list[str], players_per_game: int = 4):
+        self.ring = HashRing(shards)
+        self.shard_2_stub = {shard: server_pb2_grpc.ServerStub(grpc.insecure_channel(shard)) for shard in shards}
+
+        self.players_per_game = players_per_game
+        self.lobby_game_id = uuid4()
+        self.lobby_seats_taken = 0
+
+        self.id_2_shard: dict[str, str] = {}
+        self.id_2_name: dict[str, str] = {}
+        self.name_2_id: dict[str, str] = {}
+        self.names: set[str] = set()  # И зарегистрированные, и те, чья регистрация на шарде ещё идёт
+
+        self.lock = Lock()
+        self.subscribe_slots = BoundedSemaphore(settings.MAX_SUBSCRIBERS)  # Как и на шарде, стрим держит поток пула
+
+        self.logger = getLogger(__name__)
+
+        self.logger.info("Router started for shards %s", shards)
+
+    def Register(self, request, context):
+        # Шард мог удалить клиента по liveness, а упавший клиент уже не придёт за своим NOT_FOUND
+        with self.lock:
+            old_id = self.name_2_id.get(request.name)
+        if old_id is not None and not self._is_registered(old_id):
+            self._forget(old_id)
+
+        with self.lock:
+            if request.name in self.names:
+                context.abort(
+                    code=grpc.StatusCode.ALREADY_EXISTS, details=f"client with name {request.name} already registered."
+                )
+            self.names.add(request.name)
+
+            game_id = self.lobby_game_id
+            self.lobby_seats_taken += 1
+            if self.lobby_seats_taken == self.players_per_game:
+                self.lobby_game_id = uuid4()
+                self.lobby_seats_taken = 0
+
+        shard = self.ring.get(game_id)
+        request.game_id = str(game_id)
+
+        try:
+            response = self.shard_2_stub[shard].Register(request)
+        except grpc.RpcError as e:
+            with self.lock:
+                self.names.discard(request.name)
+            context.abort(code=e.code(), details=e.details())
+
+        with self.lock:
+            self.id_2_shard[response.uuid] = shard
+            self.id_2_name[response.uuid] = request.name
+            self.name_2_id[request.name] = response.uuid
+
+        self.logger.info("Client %s was sent to shard %s for game %s", request.name, shard, game_id)
+
+        return response
+
+    def Leave(self, request, context):
+        response = self._forward("Leave", request, context)
+        self._forget(request.uuid)
+
+        return response
+
+    def PerformAction(self, request, context):
+        return self._forward("PerformAction", request, context)
+
+    def IsRegistered(self, request, context):
+        response = server_pb2.IsRegisteredResponse()
+        response.registered = request.uuid in self.id_2_shard and self._is_registered(request.uuid)
+        return response
+
+    def Subscribe(self, request, context):
+        stub = self._shard_stub(request.uuid, context)
+        if not self.subscribe_slots.acquire(blocking=False):
+            context.abort(code=grpc.StatusCode.RESOURCE_EXHAUSTED, details="too many subscribers, try again later.")
+
+        try:
+            call = stub.Subscribe(request)
+            context.add_callback(call.cancel)
+
+            yield from call
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.NOT_FOUND:
+                self._forget(request.uuid)
+            if e.code() != grpc.StatusCode.CANCELLED:
+                context.abort(code=e.code(), details=e.details())
+        finally:
+            self.subscribe_slots.release()
+
+    def _shard_stub(self, uuid: str, context) -> server_pb2_grpc.ServerStub:
+        if (shard := self.id_2_shard.get(uuid)) is None:
+            context.abort(code=grpc.StatusCode.NOT_FOUND, details=f"client with id {uuid} is not registered.")
+
+        return self.shard_2_stub[shard]
+
+    def _forward(self, method: str, request, context):
+        try:
+            return getattr(self._shard_stub(request.uuid, context), method)(request)
+        except grpc.RpcError as e:
+            # Шард сам удаляет клиентов, не прошедших проверку liveness; тогда освобождаем и имя
+            if e.code() == grpc.StatusCode.NOT_FOUND:
+                self._forget(request.uuid)
+            context.abort(code=e.code(), details=e.details())
+
+    def _is_registered(self, uuid: str) -> bool:
+        """Asks the client's shard whether it still knows the client; if the shard does not answer, assumes it does."""
+        if (shard := self.id_2_shard.get(uuid)) is None:
+            return False
+
+        request = server_pb2.IsRegisteredRequest()
+        request.uuid = uuid
+        try:
+            return self.shard_2_stub[shard].IsRegistered(request, timeout=1).registered
+        except grpc.RpcError:
+            return True
+
+    def _forget(self, uuid: str) -> None:
+        with self.lock:
+            self.id_2_shard.pop(uuid, None)
+            if (name := self.id_2_name.pop(uuid, None)) is not None:
+                self.names.discard(name)
+                self.name_2_id.pop(name, None)
+
+
+def serve():
+    router_servicer = RouterServicer(settings.SHARDS)
+
+    # Стримы Subscribe проксируются, поэтому занимают поток роутера так же, как и поток шарда
+    executor = futures.ThreadPoolExecutor(max_workers=settings.GRPC_SERVER_WORKERS + settings.MAX_SUBSCRIBERS)
+
+    server = grpc.server(executor)
+    server_pb2_grpc.add_ServerServicer_to_server(router_servicer, server)
+    server.add_insecure_port(f"{settings.GRPC_SERVER_HOST}:{settings.GRPC_SERVER_PORT}")
+    server.start()
+    server.wait_for_termination()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    serve()
@@ -0,0 +1,70 @@
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from logging import getLogger
+from threading import Condition
+
+
+@dataclass
+class Task:
+    name: str
+    func: Callable[[], None]
+    interval: float
+    next_run: float = 0.0
+
+
+class Scheduler:
+    """Runs periodic tasks on one thread, each on its own timer.
+
+    A task runs when its interval has passed or as soon as somebody calls `wake` with its name,
+    so handlers can trigger the work they made necessary instead of waiting for the next tick.
+    """
+
+    def __init__(self):
+        self.tasks: dict[str, Task] = {}
+        self.condition = Condition()
+        self.running = False
+
+        self.logger = getLogger(__name__)
+
+    def add_task(self, name: str, func: Callable[[], None], interval: float) -> None:
+        with self.condition:
+            self.tasks[name] = Task(name=name, func=func, interval=interval)
+            self.condition.notify()
+
+    def wake(self, *names: str) -> None:
+        with self.condition:
+            for name in names:
+                if name in self.tasks:
+                    self.tasks[name].next_run = 0.0
+            self.condition.notify()
+
+    def stop(self) -> None:
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def _wait_for_due_tasks(self) -> list[Task]:
+        with self.condition:
+            while self.running:
+                now = time.monotonic()
+                due_tasks = [task for task in self.tasks.values() if task.next_run <= now]
+                if due_tasks:
+                    for task in due_tasks:  # Выставляем заранее, чтобы wake во время выполнения не потерялся
+                        task.next_run = now + task.interval
+                    return due_tasks
+
+                timeout = min((task.next_run for task in self.tasks.values()), default=now + 1) - now
+                self.condition.wait(timeout=timeout)
+
+            return []
+
+    def run(self) -> None:
+        self.running = True
+
+        while due_tasks := self._wait_for_due_tasks():
+            for task in due_tasks:
+                try:
+                    task.func()
+                except Exception:
+                    self.logger.exception("Task %s failed", task.name)
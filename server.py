@@ -1,60 +1,292 @@
 import logging
+import math
+import signal
 import time
+from collections import OrderedDict
+from collections.abc import Callable
 from concurrent import futures
+from functools import wraps
 from uuid import UUID, uuid4
 import grpc
 
-from threading import Lock
+from queue import Empty, Queue
+from threading import BoundedSemaphore, Lock, Thread, current_thread, main_thread
 
 from python_proto import server_pb2, server_pb2_grpc, client_pb2, client_pb2_grpc
-from enums import RoleEnum, ActionsEnum
+from enums import AudienceEnum, RoleEnum, ActionsEnum
+from channel_pool import ChannelPool
+from fanout import FanOut, NotStartedError
+from logs import setup_logging
 from mafia import Game
+from scheduler import Scheduler
 from settings import settings
+from sharding import HashRing
 import google.protobuf.empty_pb2
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class Outbox:
+    """Collects events per client, so everything produced for one client in a tick goes out as one NotifyBatch."""
+
+    def __init__(self, on_put: Callable[[], None] | None = None):
+        self.on_put = on_put
+        self.lock = Lock()
+        self.client_2_events: dict["ClientStub", list[client_pb2.Event]] = {}
+
+    def put(self, client: "ClientStub", event: client_pb2.Event) -> None:
+        with self.lock:
+            self.client_2_events.setdefault(client, []).append(event)
+
+        if self.on_put is not None:
+            self.on_put()
+
+    def drain(self, skip: set["ClientStub"] = frozenset()) -> dict["ClientStub", list[client_pb2.Event]]:
+        """Takes the events of every client except the ones in `skip`, whose events keep waiting."""
+        with self.lock:
+            client_2_events, self.client_2_events = self.client_2_events, {}
+            for client in skip & client_2_events.keys():
+                self.client_2_events[client] = client_2_events.pop(client)
+
+        return client_2_events
+
+    def __contains__(self, client: "ClientStub") -> bool:
+        with self.lock:
+            return client in self.client_2_events
 
 
 class ClientStub:
-    def __init__(self, host: str, port: int, name: str):
-        self.stub = client_pb2_grpc.ClientStub(grpc.insecure_channel(f"{host}:{port}"))
+    def __init__(self, host: str, port: int, name: str, outbox: Outbox, channel_pool: ChannelPool):
+        self.host = host
+        self.port = port
         self.name = name
         self.id = uuid4()
         self.game_id: UUID | None = None
+        self.requested_game_id: UUID | None = None  # Игра, которую роутер выбрал для клиента при регистрации
+
+        self.suspicion = 0  # Сколько проверок liveness подряд (с учётом успешных) клиент провалил
+        self.sent_available_actions = -1  # Маска последних отправленных доступных действий, -1 - неизвестно
+        self.next_probe = 0.0
+
+        self.outbox = outbox
+        self.channel_pool = channel_pool
+
+        self._stub: client_pb2_grpc.ClientStub | None = None
+        self.stub_lock = Lock()  # Два потока рассылки не должны взять канал из пула дважды
+        self.closed = False
+        # Не None, пока клиент слушает Subscribe. Клиенту без своего сервера (port == 0) их больше некуда
+        # доставить, поэтому у него очередь есть всегда и копит события между стримами, начиная с Register
+        self.events: Queue[client_pb2.Event | None] | None = Queue() if not port else None
+        self.events_lock = Lock()  # Событие не должно попасть в очередь стрима, который уже отцепили
+        self.streaming = False
 
         self.logger = logging.getLogger(__name__)
 
+    @property
+    def target(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    @property
+    def stub(self) -> client_pb2_grpc.ClientStub:
+        with self.stub_lock:
+            if self.closed:  # Иначе канал снова взяли бы из пула, и его уже никто бы не вернул
+                raise ConnectionError(f"client {self.name} was removed from the server")
+            if self._stub is None:
+                self._stub = client_pb2_grpc.ClientStub(self.channel_pool.acquire(self.target))
+            return self._stub
+
+    def close(self) -> None:
+        """Stops the client's stream and returns its channel to the pool; everything sent to it later is dropped."""
+        self.unsubscribe()
+
+        with self.stub_lock:
+            self.closed = True
+            stub, self._stub = self._stub, None
+
+        if stub is not None:
+            self.channel_pool.release(self.target)
+
+    def subscribe(self) -> Queue:
+        with self.events_lock:
+            if self.streaming:
+                self._detach()
+            if self.events is None:
+                self.events = Queue()
+
+            self.streaming = True
+            return self.events
+
+    def unsubscribe(self, events: Queue | None = None) -> None:
+        """Ends the stream reading `events` (any current one by default), unless the client has already moved on."""
+        with self.events_lock:
+            if events is None or events is self.events:
+                self._detach()
+
+    def _detach(self) -> None:
+        if (old := self.events) is None:
+            return
+
+        if self.port:
+            self.events = None
+        else:
+            # Недоставленное переезжает в новую очередь и дождётся следующего Subscribe
+            self.events = Queue()
+            while True:
+                try:
+                    event = old.get_nowait()
+                except Empty:  # Стрим мог забрать последнее событие сам
+                    break
+                if event is not None:
+                    self.events.put(event)
+
+        old.put(None)
+        self.streaming = False
+
     def notify_join(self, name: str) -> None:
         message = client_pb2.JoinNotification()
         message.player = name
-        self.stub.NotifyJoin(message, timeout=1)
+        self._send(client_pb2.Event(join=message))
 
     def notify_leave(self, name: str) -> None:
         message = client_pb2.LeaveNotification()
         message.player = name
-        self.stub.NotifyLeave(message, timeout=1)
+        self._send(client_pb2.Event(leave=message))
 
     def notify_action(self, notification: str) -> None:
         message = client_pb2.ActionNotification()
         message.notification = notification
-        self.stub.NotifyAction(message, timeout=1)
+        self._send(client_pb2.Event(action=message))
 
     def send_role(self, role: RoleEnum) -> None:
         message = client_pb2.Role()
         message.role = role.value
-        self.stub.SendRole(message, timeout=1)
+        self._send(client_pb2.Event(role=message))
 
     def send_available_actions(self, actions: list[ActionsEnum]):
         message = client_pb2.AvailableActions()
         message.actions.extend([action.value for action in actions])
-        self.stub.SendAvailableActions(message, timeout=1)
+        self._send(client_pb2.Event(available_actions=message))
+
+    def send_batch(self, events: list[client_pb2.Event], timeout: float = 1) -> None:
+        if self.closed:  # События, скопившиеся в outbox до того, как клиента удалили
+            return
+
+        message = client_pb2.EventBatch()
+        message.events.extend(events)
+        self.stub.NotifyBatch(message, timeout=timeout)
+
+    def livez(self, timeout: float = 1):
+        if self.streaming:  # Открытый стрим сам по себе подтверждает, что клиент жив
+            return
+        if not self.port:  # Клиенту без своего сервера больше нечем подтвердить, что он жив
+            raise ConnectionError(f"client {self.name} has no open event stream")
 
-    def livez(self):
         message = client_pb2.LivezRequest()
-        self.stub.Livez(message, timeout=1)
+        self.stub.Livez(message, timeout=timeout)
+
+    def _send(self, event: client_pb2.Event) -> None:
+        if self.closed:
+            return
+
+        with self.events_lock:
+            if (events := self.events) is not None:
+                events.put(event)
+                return
+
+        self.outbox.put(self, event)
+
+
+class StatsWriter:
+    """Write-behind queue for the REST stats service.
+
+    Registrations and finished games are queued by the gRPC handlers and sent from a background thread over one
+    pooled HTTP session, several queued items at a time, so a slow REST service never stalls the game server.
+    """
+
+    def __init__(self, rest: str, batch_size: int, retries: int):
+        self.rest = rest
+        self.batch_size = batch_size
+
+        self.session = requests.Session()
+        # Повторяем только то, что точно не дошло до сервера, чтобы не прибавить результаты игры дважды
+        retry = Retry(total=retries, connect=retries, read=0, status=retries, status_forcelist=(502, 503, 504),
+                      allowed_methods=None, backoff_factor=0.5)
+        self.session.mount("http://", HTTPAdapter(max_retries=retry))
+
+        self.logger = logging.getLogger(__name__)
+
+        self.queue: Queue[tuple[str, dict] | None] = Queue()
+        self.thread = Thread(target=self._run, name="stats-writer", daemon=True)
+        self.thread.start()
+
+    def add_player(self, name: str) -> None:
+        self.queue.put(("player", {"name": name}))
+
+    def add_game_results(self, game: Game) -> None:
+        winner_team = game.check_game_end()
+
+        self.queue.put(("game", {
+            "id": str(game.id),
+            "winner": winner_team.value,
+            "duration": game.time_end - game.time_start,
+            "players": [
+                {"name": player.name, "role": player.role.value, "win": player.role == winner_team}
+                for player in game.players()
+            ]
+        }))
+
+    def close(self, timeout: float | None = None) -> None:
+        """Sends everything that is still queued and stops the background thread."""
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.session.close()
+
+    def _run(self) -> None:
+        while (item := self.queue.get()) is not None:
+            batch = [item]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                if (item := self.queue.get_nowait()) is None:
+                    self.queue.put(None)  # Допишем текущую пачку и выйдем на следующей итерации
+                    break
+                batch.append(item)
+
+            self._send(batch)
+
+    def _send(self, batch: list[tuple[str, dict]]) -> None:
+        games = [payload for kind, payload in batch if kind == "game"]
+        # Игроков из законченных игр сервис создаёт сам при записи результатов
+        names = {payload["name"] for kind, payload in batch if kind == "player"}
+        names.difference_update(player["name"] for game in games for player in game["players"])
+
+        # Результаты игр первыми и отдельно от регистраций, чтобы ошибка с одним игроком не потеряла их
+        if games:
+            try:
+                self.session.post(self.rest + "/games/results", json=games).raise_for_status()
+            except requests.RequestException:
+                self.logger.exception("Failed to send %d game results to the stats service", len(games))
+
+        for name in names:
+            try:
+                self.session.post(self.rest + f"/players/{name}", json={"name": name}).raise_for_status()
+            except requests.RequestException:
+                self.logger.exception("Failed to register player %s in the stats service", name)
+
+
+def unary_rpc(method):
+    """Runs at most GRPC_SERVER_WORKERS unary handlers at once; the other pool threads serve Subscribe streams."""
+    @wraps(method)
+    def wrapper(self, request, context):
+        with self.rpc_slots:
+            return method(self, request, context)
+
+    return wrapper
 
 
 class ServerServicer(server_pb2_grpc.ServerServicer):
-    def __init__(self):
+    def __init__(self, scheduler: Scheduler):
+        self.scheduler = scheduler
+
         self.id_2_registered_clients: dict[UUID, ClientStub] = {}
         self.name_2_registered_clients: dict[str, ClientStub] = {}
         self.id_2_active_clients: dict[UUID, ClientStub] = {}
@@ -62,203 +294,467 @@ class ServerServicer(server_pb2_grpc.ServerServicer):
 
         self.id_2_game: dict[UUID, Game] = {}
 
-        self.last_checkpoint = time.time()
-
-        self.lock = Lock()
+        self.idle_clients: OrderedDict[str, ClientStub] = OrderedDict()  # Зарегистрированы, но ещё не в игре
+        self.open_games: OrderedDict[UUID, Game] = OrderedDict()  # Ещё не начались и есть свободные места
+        self.full_games: OrderedDict[UUID, Game] = OrderedDict()  # Все места заняты, ждут start_games
+
+        self.lock = Lock()  # Защищает реестры выше; под ним никогда не берётся лок игры
+
+        # Игры, изменившиеся с прошлого запуска задачи; задачи рассылки обходят только их, а не все игры
+        self.task_2_changed_games: dict[str, dict[UUID, Game]] = {
+            "send_notifications": {}, "send_action_requests": {}
+        }
+        self.changed_games_lock = Lock()  # Берётся в том числе под локом игры
+        self.rpc_slots = BoundedSemaphore(settings.GRPC_SERVER_WORKERS)
+        # Стрим держит поток пула всё время подписки; без предела стримы заняли бы и потоки унарных вызовов
+        self.subscribe_slots = BoundedSemaphore(settings.MAX_SUBSCRIBERS)
+
+        self.fan_out = FanOut(max_workers=settings.NOTIFY_WORKERS, timeout=settings.NOTIFY_TIMEOUT)
+        # Рассылка не ждёт ответов: пачки ещё в пути и результаты проверок liveness собираются здесь
+        self.clients_sending: set[ClientStub] = set()
+        self.probe_results: list[tuple[ClientStub, BaseException | None, float]] = []
+        self.fan_out_lock = Lock()
+        self.outbox = Outbox(on_put=lambda: self.scheduler.wake("flush_events"))
+        self.channel_pool = ChannelPool(idle_timeout=settings.CHANNEL_IDLE_TIMEOUT)
+
+        # В шардированном режиме процесс владеет только играми, чей id попадает на него в кольце
+        self.shard = settings.SHARDS[settings.SHARD_INDEX] if settings.SHARD_INDEX is not None else None
+        self.ring = HashRing(settings.SHARDS) if self.shard is not None else None
 
         self.rest = f"http://{settings.REST_HOST}:{settings.REST_PORT}" if settings.REST_PORT else None
+        self.stats_writer = (
+            StatsWriter(self.rest, settings.REST_BATCH_SIZE, settings.REST_RETRIES) if self.rest is not None else None
+        )
 
         self.logger = logging.getLogger(__name__)
 
         self.logger.info("Server started")
 
+    @unary_rpc
     def Register(self, request, context):
-        if request.name in self.name_2_registered_clients:
+        client_stub = ClientStub(request.host, request.port, request.name, self.outbox, self.channel_pool)
+        if request.HasField("game_id"):
+            client_stub.requested_game_id = UUID(request.game_id)
+
+        with self.lock:
+            already_registered = request.name in self.name_2_registered_clients
+            if not already_registered:
+                self.id_2_registered_clients[client_stub.id] = client_stub
+                self.name_2_registered_clients[client_stub.name] = client_stub
+
+        if already_registered:
             context.abort(
                 code=grpc.StatusCode.ALREADY_EXISTS, details=f"client with name {request.name} already registered."
             )
 
         else:
-            if self.rest is not None:
-                requests.post(self.rest + f"/players/{request.name}", json={"name": request.name})
-            client_stub = ClientStub(request.host, request.port, request.name)
-            self.id_2_registered_clients[client_stub.id] = client_stub
-            self.name_2_registered_clients[client_stub.name] = client_stub
-            self.id_2_active_clients[client_stub.id] = client_stub
-            self.name_2_active_client[client_stub.name] = client_stub
+            if self.stats_writer is not None:
+                self.stats_writer.add_player(request.name)
+
+            with self.lock:
+                self.id_2_active_clients[client_stub.id] = client_stub
+                self.name_2_active_client[client_stub.name] = client_stub
+                self.idle_clients[client_stub.name] = client_stub
+
+            self.scheduler.wake("connect_players_to_games")
 
             response = server_pb2.RegisterResponse()
             response.uuid = str(client_stub.id)
 
             return response
 
+    @unary_rpc
     def Leave(self, request, context):
-        player_uuid = UUID(request.uuid)
-        player = self.id_2_registered_clients[player_uuid]
+        if (player := self.id_2_registered_clients.get(UUID(request.uuid))) is not None:
+            self.evict(player)
 
-        if player_uuid not in self.id_2_active_clients:
-            return
+        return google.protobuf.empty_pb2.Empty()
 
-        del self.id_2_active_clients[player_uuid]
-        del self.name_2_active_client[player.name]
+    @unary_rpc
+    def PerformAction(self, request, context):
+        if (player := self.id_2_active_clients.get(UUID(request.uuid))) is None:
+            context.abort(code=grpc.StatusCode.NOT_FOUND, details=f"client with id {request.uuid} is not registered.")
+        if (game := self.id_2_game.get(player.game_id)) is None:
+            context.abort(code=grpc.StatusCode.FAILED_PRECONDITION, details=f"client {player.name} is not in a game.")
+
+        # Лок держим и на время рассылки, чтобы сообщение о ходе ушло раньше сообщений о смене фазы, которую он вызвал
+        with game.lock:
+            target_name = request.target_name if request.HasField("target_name") else None
+            try:
+                events = game.apply_action(player.name, request.action, target_name)
+            except ValueError as e:
+                player.sent_available_actions = -1  # Клиент уже сбросил выбранное действие, пусть получит их снова
+                self.queue_game(game, "send_action_requests")
+                context.abort(code=grpc.StatusCode.INVALID_ARGUMENT, details=str(e))
+
+            for event in events:
+                self.logger.debug("Notification to send to clients: %s", event.text)
+                if event.audience == AudienceEnum.MAFIA:
+                    self.send_action_notification_to_group(event.text, game, game.mafia_names)
+                elif event.audience == AudienceEnum.COP:
+                    self.send_action_notification_to_group(event.text, game, [game.cop_name])
+                else:
+                    self.send_action_notification_to_group(event.text, game, list(game.names))
+
+        self.queue_game(game, "send_action_requests")
 
-        self.id_2_game[player.game_id].kill_player(player.name)
+        return google.protobuf.empty_pb2.Empty()
 
-        for client in self.id_2_active_clients.values():
-            client.notify_leave(self.id_2_registered_clients[player_uuid].name)
+    @unary_rpc
+    def IsRegistered(self, request, context):
+        response = server_pb2.IsRegisteredResponse()
+        response.registered = UUID(request.uuid) in self.id_2_registered_clients
+        return response
 
-        return google.protobuf.empty_pb2.Empty()
+    def Subscribe(self, request, context):
+        client = self.id_2_registered_clients.get(UUID(request.uuid))
+        if client is None:
+            context.abort(code=grpc.StatusCode.NOT_FOUND, details=f"client with id {request.uuid} is not registered.")
 
-    def PerformAction(self, request, context):
-        player = self.id_2_active_clients[UUID(request.uuid)]
-        game = self.id_2_game[player.game_id]
-        available_actions = game.get_available_actions_for_player(player.name)
-        if request.action not in available_actions:
-            context.abort(
-                code=grpc.StatusCode.INVALID_ARGUMENT,
-                details=f"Action is not available. Available actions: {available_actions}"
-            )
+        if not self.subscribe_slots.acquire(blocking=False):
+            context.abort(code=grpc.StatusCode.RESOURCE_EXHAUSTED, details="too many subscribers, try again later.")
 
-        target_name = request.target_name if request.HasField("target_name") else None
-        notification = game.add_player_action_generator_instance.send([player.name, request.action, target_name])
+        events = client.subscribe()
+        try:
+            context.add_callback(lambda: events.put(None))
 
-        self.logger.info(f"Notification to send to clients: {notification}")
-        if request.action == ActionsEnum.KILL:
-            self.send_action_notification_to_group(notification, list(game.name_2_mafia_player.keys()))
-        elif request.action == ActionsEnum.CHECK:
-            self.send_action_notification_to_group(notification, [game.cop_player.name])
-        else:
-            self.send_action_notification_to_group(notification, list(game.name_2_player.keys()))
+            self.logger.info("Client %s subscribed to events", client.name)
 
-        game.add_player_action_generator_instance.send(None)
+            while (event := events.get()) is not None:
+                yield event
 
-        return google.protobuf.empty_pb2.Empty()
+        finally:
+            # Сюда приходят и тогда, когда gRPC закрыл генератор на оборванном стриме
+            client.unsubscribe(events)
+            self.subscribe_slots.release()
+            self.logger.info("Client %s unsubscribed from events", client.name)
 
-    def send_action_notification_to_group(self, notification: str, names: list[str]):
+    def send_action_notification_to_group(self, notification: str, game: Game, names: list[str]):
         for name in names:
-            if name in self.name_2_active_client:
-                self.name_2_registered_clients[name].notify_action(notification)
+            if (client := self.client_in_game(name, game)) is not None:
+                client.notify_action(notification)
 
-    def connect_player_to_game(self, name: str) -> None:
-        for game_id, game in self.id_2_game.items():
-            if game.add_player(name):
-                selected_game_id = game_id
-                for player in self.id_2_game[selected_game_id].name_2_player.keys():
-                    self.name_2_active_client[name].notify_join(player)
+    def client_in_game(self, name: str, game: Game) -> ClientStub | None:
+        """The client seated in `game` under `name`, None if it has left.
 
-                break
-        else:
-            selected_game_id = uuid4()
-            self.id_2_game[selected_game_id] = Game(selected_game_id)
-            self.id_2_game[selected_game_id].add_player(name)
+        The name alone is not enough: after an eviction it can already belong to a new client playing another game.
+        """
+        if (client := self.name_2_active_client.get(name)) is not None and client.game_id == game.id:
+            return client
+        return None
 
-        for player in self.id_2_game[selected_game_id].name_2_player.keys():
-            if self.name_2_active_client[player].game_id == selected_game_id:
-                self.name_2_active_client[player].notify_join(name)
+    def evict(self, player: ClientStub) -> None:
+        """Removes the client from every registry and from its game, as if it left on its own."""
+        with self.lock:
+            if self.id_2_registered_clients.pop(player.id, None) is None:
+                return
 
-        player = self.name_2_registered_clients[name]
-        player.game_id = selected_game_id
-        self.id_2_active_clients[player.id] = player
+            self.name_2_registered_clients.pop(player.name, None)
+            self.id_2_active_clients.pop(player.id, None)
+            self.name_2_active_client.pop(player.name, None)
+            self.idle_clients.pop(player.name, None)
 
-    def start_games(self):
-        if time.time() > self.last_checkpoint + 20:
-            for game_id, game in self.id_2_game.items():
-                if game.ready_to_start:
-                    game.start_game()
+            # connect_player_to_game выставляет game_id под этим же локом, так что место в игре не потеряется
+            game = self.id_2_game.get(player.game_id)
+            clients_to_notify = list(self.id_2_active_clients.values())
+
+        player.close()
+
+        if game is not None and game.leave(player.name):  # Освободилось место в лобби
+            with self.lock:
+                self._index_game(game)
+
+        for client in clients_to_notify:
+            client.notify_leave(player.name)
+
+        self.logger.info("Client %s was removed from the server", player.name)
+
+        if game is not None:
+            self.queue_game(game, "send_notifications", "send_action_requests")
+        self.scheduler.wake("check_finished_games")
+
+    def on_game_update(self, game: Game) -> None:
+        if game.finished:
+            self.scheduler.wake("check_finished_games")
+        elif game.ready_to_start:
+            self.scheduler.wake("start_games")
+        elif game.started:
+            self.queue_game(game, "send_notifications", "send_action_requests")
+
+    def queue_game(self, game: Game, *tasks: str) -> None:
+        """Queues `game` for the given sending tasks and wakes them."""
+        with self.changed_games_lock:
+            for task in tasks:
+                self.task_2_changed_games[task][game.id] = game
+
+        self.scheduler.wake(*tasks)
+
+    def queue_all_games(self) -> None:
+        """Queues every game for the sending tasks, catching up with whatever changed without queueing its game."""
+        with self.lock:
+            games = list(self.id_2_game.values())
+
+        with self.changed_games_lock:
+            for changed_games in self.task_2_changed_games.values():
+                changed_games.update((game.id, game) for game in games)
+
+    def _take_changed_games(self, task: str) -> list[Game]:
+        with self.changed_games_lock:
+            changed_games, self.task_2_changed_games[task] = self.task_2_changed_games[task], {}
+
+        return list(changed_games.values())
+
+    def connect_player_to_game(self, client: ClientStub) -> None:
+        game = self._take_seat(client.name, client.requested_game_id)
+        client.requested_game_id = None
+
+        with self.lock:
+            # Клиент мог уйти, пока занимал место: evict не нашёл его в игре, значит, освободить место должны мы
+            registered = self.id_2_registered_clients.get(client.id) is client
+            if registered:
+                client.game_id = game.id
+            self._index_game(game)
+
+        if not registered:
+            game.leave(client.name)
+            with self.lock:
+                self._index_game(game)
+            return
+
+        for player in game.names:
+            client.notify_join(player)
+
+        for player in game.names:
+            if (other := self.client_in_game(player, game)) not in (None, client):
+                other.notify_join(client.name)
+
+    def _take_seat(self, name: str, requested_game_id: UUID | None) -> Game:
+        if requested_game_id is not None:
+            with self.lock:
+                game = self.id_2_game.get(requested_game_id)
+            game = game or self._create_game(requested_game_id)
+            if game.add_player(name):
+                return game
+
+        while True:
+            with self.lock:
+                if (game := next(iter(self.open_games.values()), None)) is None:
+                    break
+            if game.add_player(name):
+                return game
+
+            with self.lock:  # Место занял кто-то другой или игра уже началась
+                self._index_game(game)
 
-                    for name, player in game.name_2_player.items():
-                        self.name_2_active_client[name].send_role(player.role)
+        game = self._create_game(self.ring.new_game_id(self.shard) if self.ring is not None else uuid4())
+        game.add_player(name)
+        return game
 
-            self.last_checkpoint = time.time()
+    def _create_game(self, game_id: UUID) -> Game:
+        game = Game(game_id, on_update=self.on_game_update)
+        with self.lock:
+            self.id_2_game[game_id] = game
+            self.open_games[game_id] = game
+
+        return game
+
+    def _index_game(self, game: Game) -> None:
+        """Moves the game to open_games or full_games by its current seats; called under self.lock.
+
+        Everybody who changes the seats of a game calls this afterwards, so the last call sees the final state.
+        """
+        if game.finished or game.id not in self.id_2_game or game.started:
+            self.open_games.pop(game.id, None)
+            self.full_games.pop(game.id, None)
+        elif game.has_free_seats:
+            self.full_games.pop(game.id, None)
+            self.open_games.setdefault(game.id, game)
+        else:
+            self.open_games.pop(game.id, None)
+            self.full_games.setdefault(game.id, game)
+
+    def start_games(self):
+        while True:
+            with self.lock:
+                if not self.full_games:
+                    return
+                _, game = self.full_games.popitem(last=False)
+
+            # Не начнётся, если кто-то успел уйти: тогда evict уже вернул игру в open_games
+            if game.start_game():
+                for player in game.players():
+                    if (client := self.client_in_game(player.name, game)) is not None:
+                        client.send_role(player.role)
+                self.queue_game(game, "send_notifications", "send_action_requests")
 
     def connect_players_to_games(self):
-        for name, client in self.name_2_active_client.items():
-            if client.game_id is None:
-                self.connect_player_to_game(name)
+        while True:
+            with self.lock:
+                if not self.idle_clients:
+                    return
+                name, client = self.idle_clients.popitem(last=False)
+                connect = self.id_2_registered_clients.get(client.id) is client and client.game_id is None
+
+            if connect:
+                self.connect_player_to_game(client)
 
     def check_finished_games(self) -> None:
-        games_to_del = []
-        for game_id, game in self.id_2_game.items():
-            if game.finished:
-                games_to_del.append(game_id)
-                for name in game.name_2_player.keys():
-                    self.name_2_active_client[name].notify_action(f"Game finished, {game.check_game_end()} won")
-                    self.name_2_registered_clients[name].game_id = None
-                    for player in game.name_2_player.keys():
-                        self.name_2_active_client[name].notify_leave(player)
-
-        for game_id in games_to_del:
-            self.update_player_data(self.id_2_game[game_id])
-            del self.id_2_game[game_id]
+        with self.lock:
+            finished_games = [game for game in self.id_2_game.values() if game.finished]
 
-    def update_player_data(self, game: Game) -> None:
-        winner_team = game.check_game_end()
+        for game in finished_games:
+            with game.lock:
+                for name in game.names:
+                    if (client := self.client_in_game(name, game)) is None:
+                        continue
+
+                    client.game_id = None
+                    client.sent_available_actions = -1
+                    client.notify_action(f"Game finished, {game.check_game_end()} won")
+                    for player in game.names:
+                        client.notify_leave(player)
+
+                    with self.lock:
+                        self.idle_clients[name] = client
+
+        for game in finished_games:
+            self.update_player_data(game)
+            with self.lock:
+                del self.id_2_game[game.id]
+                self.open_games.pop(game.id, None)
+                self.full_games.pop(game.id, None)
 
-        for name, player in game.name_2_player.items():
-            requests.post(self.rest + f"/players/{name}", json={"name": name})
-            requests.patch(self.rest + f"/players/add_to_player/{name}", json={
-                "name": name,
-                "wins": (player.role == winner_team),
-                "losses": (player.role != winner_team),
-                "time_played": game.time_end - game.time_start
-            })
+        if finished_games:
+            self.scheduler.wake("connect_players_to_games")
+
+    def update_player_data(self, game: Game) -> None:
+        if self.stats_writer is not None:
+            self.stats_writer.add_game_results(game)
 
     def send_action_requests(self) -> None:
-        with self.lock:
-            for game in self.id_2_game.values():
+        for game in self._take_changed_games("send_action_requests"):
+            with game.lock:
                 if game.started and not game.finished:
-                    for player in game.name_2_player.values():
-                        if player.name in self.name_2_active_client and player.alive:
-                            if available_actions := game.get_available_actions_for_player(player.name):
-                                self.name_2_active_client[player.name].send_available_actions(available_actions)
+                    for name in game.names:
+                        if (client := self.client_in_game(name, game)) is None:
+                            continue
+
+                        # Шлём только изменившиеся наборы; пустой набор тоже запоминаем, но не отправляем
+                        mask = game.available_actions_mask(name)
+                        if mask != client.sent_available_actions:
+                            client.sent_available_actions = mask
+                            if mask:
+                                client.send_available_actions(game.get_available_actions_for_player(name))
 
     def send_notifications(self):
-        for game in self.id_2_game.values():
-            if game.started and not game.finished:
-                for player in game.name_2_player.values():
-                    if player.name in self.name_2_active_client:
-                        for notification in game.get_and_delete_notifications():
-                            self.name_2_active_client[player.name].notify_action(notification)
+        for game in self._take_changed_games("send_notifications"):
+            with game.lock:
+                if game.started and not game.finished:
+                    notifications = game.get_and_delete_notifications()
+                    for name in game.names:
+                        if (client := self.client_in_game(name, game)) is not None:
+                            for notification in notifications:
+                                client.notify_action(notification)
+
+    def flush_events(self) -> None:
+        # Пока пачка клиента в пути, следующая ждёт её, иначе они могли бы прийти не по порядку
+        with self.fan_out_lock:
+            client_2_events = self.outbox.drain(skip=self.clients_sending)
+            self.clients_sending.update(client_2_events)
+
+        self.fan_out.send(
+            client_2_events, lambda client, timeout: client.send_batch(client_2_events[client], timeout),
+            self._on_batch_sent
+        )
+
+    def _on_batch_sent(self, client: ClientStub, exception: BaseException | None) -> None:
+        # Набор действий мог пропасть вместе с пачкой; -1 заставит send_action_requests отправить его снова
+        if exception is not None:
+            client.sent_available_actions = -1
+            if (game := self.id_2_game.get(client.game_id)) is not None:
+                self.queue_game(game, "send_action_requests")
+
+        with self.fan_out_lock:
+            self.clients_sending.discard(client)
+        if client in self.outbox:  # Накопилось, пока пачка была в пути
+            self.scheduler.wake("flush_events")
 
     def check_liveness(self):
-        to_delete = set()
-        for client in self.name_2_active_client.values():
-            try:
-                client.livez()
-            except grpc.RpcError:
-                to_delete.add(client.name)
-        for name in to_delete:
-            del self.name_2_active_client[name]
+        """Probes all due clients at once and evicts the ones that kept failing.
+
+        Probes do not hold up the scheduler: their results are collected as they come and applied on the next
+        round. Every failed probe raises the client's suspicion and postpones its next probe exponentially, a
+        successful one lowers it again, so a flapping client is evicted too. A probe that never started because
+        the pool was busy with hanging clients is not held against the client; it is simply repeated.
+        """
+        with self.fan_out_lock:
+            probe_results, self.probe_results = self.probe_results, []
+
+        for client, exception, finished in probe_results:
+            if isinstance(exception, NotStartedError):
+                client.next_probe = 0
+                continue
+            if exception is not None:
+                client.suspicion += 1
+                client.next_probe = finished + min(2 ** client.suspicion, settings.LIVENESS_MAX_BACKOFF)
+            else:
+                client.suspicion = max(client.suspicion - 1, 0)
+                client.next_probe = 0
+
+            if client.suspicion >= settings.LIVENESS_MAX_SUSPICION:
+                self.evict(client)
+
+        now = time.monotonic()
+        with self.lock:
+            clients = [client for client in self.name_2_active_client.values() if client.next_probe <= now]
+        # Пул отрабатывает задачи по порядку: сначала проверяем тех, кто отвечал, чтобы зависшие их не задержали
+        clients.sort(key=lambda client: client.suspicion)
+        for client in clients:
+            client.next_probe = math.inf  # Пока проба в пути, новая не нужна
+
+        self.fan_out.send(clients, lambda client, timeout: client.livez(timeout), self._on_probe)
+
+    def _on_probe(self, client: ClientStub, exception: BaseException | None) -> None:
+        with self.fan_out_lock:
+            self.probe_results.append((client, exception, time.monotonic()))
+
+        self.logger.debug("Active clients: %s", list(self.name_2_active_client))
 
 
 def serve():
-    server_servicer = ServerServicer()
+    scheduler = Scheduler()
+    server_servicer = ServerServicer(scheduler)
 
-    executor = futures.ThreadPoolExecutor(max_workers=1)
+    # Каждый стрим Subscribe занимает поток на всё время подписки
+    executor = futures.ThreadPoolExecutor(max_workers=settings.GRPC_SERVER_WORKERS + settings.MAX_SUBSCRIBERS)
 
     server = grpc.server(executor)
     server_pb2_grpc.add_ServerServicer_to_server(server_servicer, server)
-    server.add_insecure_port(f"{settings.GRPC_SERVER_HOST}:{settings.GRPC_SERVER_PORT}")
+    server.add_insecure_port(server_servicer.shard or f"{settings.GRPC_SERVER_HOST}:{settings.GRPC_SERVER_PORT}")
     server.start()
 
-    while True:
-        server_servicer.check_liveness()
-
-        server_servicer.check_finished_games()
-
-        server_servicer.connect_players_to_games()
-
-        server_servicer.start_games()
-
-        server_servicer.send_notifications()
-
-        server_servicer.send_action_requests()
+    # Задачи выполняются в порядке добавления, если одновременно наступило время нескольких из них
+    scheduler.add_task("check_liveness", server_servicer.check_liveness, interval=4)
+    scheduler.add_task("check_finished_games", server_servicer.check_finished_games, interval=4)
+    scheduler.add_task("connect_players_to_games", server_servicer.connect_players_to_games, interval=4)
+    scheduler.add_task("start_games", server_servicer.start_games, interval=20)
+    scheduler.add_task("queue_all_games", server_servicer.queue_all_games, interval=4)
+    scheduler.add_task("send_notifications", server_servicer.send_notifications, interval=4)
+    scheduler.add_task("send_action_requests", server_servicer.send_action_requests, interval=4)
+    scheduler.add_task("flush_events", server_servicer.flush_events, interval=1)
+    scheduler.add_task("evict_idle_channels", server_servicer.channel_pool.evict_idle, interval=10)
 
-        server_servicer.logger.info(server_servicer.name_2_active_client)
+    if current_thread() is main_thread():  # docker stop шлёт SIGTERM, по нему дописываем очередь в REST и выходим
+        signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
 
-        time.sleep(4)
+    try:
+        scheduler.run()
+    finally:
+        server.stop(grace=1)
+        if server_servicer.stats_writer is not None:
+            server_servicer.stats_writer.close()
 
 
 if __name__ == '__main__':
-    logging.basicConfig(level=logging.DEBUG)
+    setup_logging()
     serve()
@@ -6,16 +6,64 @@ from enums import RoleEnum
 class Settings(BaseSettings):
     GRPC_SERVER_HOST: str = "proto_server"
     GRPC_SERVER_PORT: int = 50051
+    GRPC_SERVER_WORKERS: int = 8
+    MAX_SUBSCRIBERS: int = 64
+
+    SHARDS: list[str] = []  # Адреса шардов игрового сервера, например ["127.0.0.1:50061", "127.0.0.1:50062"]
+    SHARD_INDEX: int | None = None  # Номер шарда этого процесса в SHARDS; None - обычный режим без роутера
 
     GRPC_CLIENT_HOST: str = "0.0.0.0"
     GRPC_CLIENT_PORT: int = 50052
 
     CLIENT_NAME: str = "DEFAULT"
+    CLIENT_SUBSCRIBE: bool = False
+    CLIENT_RECONNECT_DELAY: float = 0.5  # Первая пауза перед повторным Subscribe, дальше она удваивается
+    CLIENT_RECONNECT_MAX_DELAY: float = 16
+
+    NOTIFY_WORKERS: int = 16
+    NOTIFY_TIMEOUT: float = 1
+
+    CHANNEL_IDLE_TIMEOUT: float = 30
+
+    LOG_LEVEL: str = "INFO"
+    LOG_LEVELS: dict[str, str] = {}  # Уровни отдельных модулей, например {"mafia": "WARNING", "grpc": "ERROR"}
+    LOG_FORMAT: str = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+    LOG_RATE_LIMIT_BURST: int = 20  # Столько записей из одного места кода проходит за LOG_RATE_LIMIT_INTERVAL секунд
+    LOG_RATE_LIMIT_INTERVAL: float = 10
+
+    LIVENESS_MAX_SUSPICION: int = 3
+    LIVENESS_MAX_BACKOFF: float = 16
 
     DB_PATH: str = "./player.db"
+    DB_POOL_SIZE: int = 8
+    DB_POOL_TIMEOUT: float = 5  # Сколько ждать свободного соединения, прежде чем ответить 503
+    DB_CACHE_SIZE_KB: int = 16384
+    DB_BUSY_TIMEOUT_MS: int = 5000
+
+    PDF_WORKERS: int = 4
+    PDF_QUEUE_SIZE: int = 64  # Сколько заданий может ждать свободного процесса, прежде чем POST /pdfs начнёт отвечать 503
+    PDF_JOBS_HISTORY: int = 1024
+    PDF_CACHE_SIZE_MB: int = 256
+    PDF_JOB_TIMEOUT: float = 300  # Задание, которое столько не двигалось, считается брошенным упавшим процессом
+
+    AVATAR_SIZE: int = 100  # Сторона в пикселях: в отчёте аватар 50x50 pt, с запасом на печать и HiDPI
+    AVATAR_QUALITY: int = 85
+    AVATAR_MAX_PIXELS: int = 40_000_000
+    AVATAR_CACHE_SIZE: int = 256
+
+    PLAYER_CACHE_SIZE: int = 4096  # 0 выключает кэш профилей
+    PLAYER_CACHE_TTL: float = 60
+
+    PLAYERS_PAGE_SIZE: int = 100
+    PLAYERS_MAX_PAGE_SIZE: int = 1000
+    LEADERBOARD_SIZE: int = 10
 
     REST_HOST: str = "app"
     REST_PORT: int = 8000
+    REST_BATCH_SIZE: int = 50
+    REST_RETRIES: int = 3
+    REST_WORKERS: int = 4  # Процессы uvicorn в режиме asgi_server.py; больше одного - кэш профилей выключен
+    REST_MAX_CONTENT_MB: int = 8  # Предел тела запроса, в первую очередь для загрузки аватаров
 
 
 settings = Settings()
@@ -0,0 +1,31 @@
+from bisect import bisect
+from hashlib import md5
+from uuid import UUID, uuid4
+
+
+class HashRing:
+    """Consistent hashing of game ids onto shard addresses.
+
+    Every shard owns `replicas` points on the ring, so adding or removing a shard only moves the games
+    that hashed next to its points.
+    """
+
+    def __init__(self, shards: list[str], replicas: int = 100):
+        self.shards = shards
+        self.ring = sorted((self._hash(f"{shard}#{replica}"), shard) for shard in shards for replica in range(replicas))
+        self.points = [point for point, _ in self.ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(md5(key.encode()).digest()[:8], "big")
+
+    def get(self, game_id: UUID) -> str:
+        index = bisect(self.points, self._hash(str(game_id))) % len(self.ring)
+        return self.ring[index][1]
+
+    def new_game_id(self, shard: str) -> UUID:
+        """Generates a game id owned by `shard`; takes len(shards) attempts on average."""
+        while self.get(game_id := uuid4()) != shard:
+            pass
+
+        return game_id
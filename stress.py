@@ -0,0 +1,103 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from logging import getLogger
+from multiprocessing import get_context
+
+import grpc
+
+from client import ClientServicer
+from logs import setup_logging
+
+
+class CountingClient(ClientServicer):
+    """Bot that plays as fast as the server lets it and counts the games it has finished."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.games_finished = 0
+
+    def NotifyAction(self, request, context):
+        if request.notification.startswith("Game finished"):
+            self.games_finished += 1
+
+        return super().NotifyAction(request, context)
+
+
+def play(port: int, names: list[str], duration: float, think: float) -> int:
+    """Runs the bots `names` against the server on `port` for `duration` s, returns how many game ends they saw."""
+    setup_logging()
+    getLogger("client").setLevel("CRITICAL")  # Стримы ботов обрываются вместе с сервером в конце раунда
+
+    # Бота без своего gRPC сервера дешевле держать: события приходят в стрим Subscribe
+    bots = [CountingClient("", 0, "127.0.0.1", port, name, subscribe=True) for name in names]
+    for bot in bots:
+        bot.connect_to_server()
+        threading.Thread(target=bot.listen, daemon=True).start()
+
+    stop = threading.Event()
+
+    def act(bot: CountingClient) -> None:
+        while not stop.is_set():
+            bot.send_action()
+            time.sleep(think)
+
+    for bot in bots:
+        threading.Thread(target=act, args=(bot,), daemon=True).start()
+
+    stop.wait(duration)
+    stop.set()
+
+    return sum(bot.games_finished for bot in bots)
+
+
+def run_round(workers: int, clients: int, processes: int, duration: float, think: float, port: int) -> float:
+    """Starts a game server with `workers` threads, lets `clients` bots play for `duration` s, returns games per second.
+
+    The bots are split between `processes` processes, so that the measurement is not held back by the GIL of the bots.
+    """
+    env = dict(os.environ, GRPC_SERVER_HOST="127.0.0.1", GRPC_SERVER_PORT=str(port),
+               GRPC_SERVER_WORKERS=str(workers), REST_PORT="0", LOG_LEVEL="WARNING")
+    server = subprocess.Popen([sys.executable, "server.py"], env=env)
+
+    try:
+        grpc.channel_ready_future(grpc.insecure_channel(f"127.0.0.1:{port}")).result(timeout=10)
+
+        names = [f"bot-{workers}-{i}" for i in range(clients)]
+        # Свежие процессы на раунд: потоки ботов прошлого раунда в них так и остались бы
+        with get_context("spawn").Pool(processes) as pool:
+            games_seen = pool.starmap(
+                play, [(port, names[index::processes], duration, think) for index in range(processes)]
+            )
+
+        # Конец игры видят все её игроки
+        return sum(games_seen) / 4 / duration
+
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Game server throughput for different GRPC_SERVER_WORKERS")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma separated worker counts to compare")
+    parser.add_argument("--clients", type=int, default=40)
+    parser.add_argument("--processes", type=int, default=4, help="the bots are split between processes")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per worker count")
+    parser.add_argument("--think", type=float, default=0.05, help="pause of every bot between its actions, s")
+    parser.add_argument("--port", type=int, default=50151)
+    args = parser.parse_args()
+
+    for index, workers in enumerate(int(workers) for workers in args.workers.split(",")):
+        games_per_second = run_round(
+            workers, args.clients, args.processes, args.duration, args.think, args.port + index
+        )
+        print(f"workers={workers} clients={args.clients} processes={args.processes}: {games_per_second:.1f} games/s",
+              flush=True)
+
+
+if __name__ == "__main__":
+    main()
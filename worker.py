@@ -1,31 +1,226 @@
-import crud
+import json
+import os
+import time
+from concurrent import futures
+from functools import lru_cache
+from hashlib import sha256
+from logging import getLogger
+from multiprocessing import get_context
+from threading import BoundedSemaphore, Lock
+from typing import BinaryIO
+
+from PIL import Image, UnidentifiedImageError
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen.canvas import Canvas
 
-from logging import getLogger
+import crud
+from settings import settings
+
 logger = getLogger(__name__)
 
+PDFS_DIR = "contents/pdfs"
+AVATARS_DIR = "contents/avatars"
+AVATAR_FORMATS = {"PNG", "JPEG", "GIF", "WEBP", "BMP"}
+
+
+def ingest_avatar(name: str, file: BinaryIO) -> str:
+    """Validates an uploaded avatar, stores it as a small JPEG of the size it is drawn at and returns the file name.
+
+    Raises ValueError for anything that is not an image of a supported format and size.
+    """
+    try:
+        with Image.open(file) as image:
+            if image.format not in AVATAR_FORMATS:
+                raise ValueError(f"Unsupported avatar format {image.format}")
+            if image.width * image.height > settings.AVATAR_MAX_PIXELS:
+                raise ValueError(f"Avatar is too large: {image.width}x{image.height}")
+
+            # Для JPEG декодер сразу уменьшает картинку в 2-8 раз, не разжимая её целиком
+            image.draft("RGB", (settings.AVATAR_SIZE, settings.AVATAR_SIZE))
+            image = image.convert("RGBA")
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ValueError(f"Bad avatar: {e}")
+
+    # В отчёте аватар растягивается в квадрат, поэтому храним сразу квадрат; прозрачность ложится на белый лист
+    image = image.resize((settings.AVATAR_SIZE, settings.AVATAR_SIZE), Image.LANCZOS)
+    background = Image.new("RGB", image.size, "white")
+    background.paste(image, mask=image.getchannel("A"))
+
+    avatar = f"{name}.jpg"
+    path = f"{AVATARS_DIR}/{avatar}"
+    background.save(f"{path}.tmp", format="JPEG", quality=settings.AVATAR_QUALITY, optimize=True)
+    os.replace(f"{path}.tmp", path)
+
+    return avatar
+
+
+@lru_cache(maxsize=settings.AVATAR_CACHE_SIZE)
+def _avatar_reader(path: str, mtime_ns: int) -> ImageReader:
+    # Аватары, загруженные до нормализации, и картинка по умолчанию уменьшаются здесь, один раз на процесс
+    with Image.open(path) as image:
+        image.draft("RGB", (settings.AVATAR_SIZE, settings.AVATAR_SIZE))
+        image = image.convert("RGB")
+    if image.width > settings.AVATAR_SIZE or image.height > settings.AVATAR_SIZE:
+        image = image.resize((settings.AVATAR_SIZE, settings.AVATAR_SIZE), Image.LANCZOS)
+
+    return ImageReader(image)
+
+
+def avatar_reader(avatar: str) -> ImageReader:
+    """Decoded avatar, shared between the reports rendered by this process until the file changes."""
+    path = f"{AVATARS_DIR}/{avatar}"
+    return _avatar_reader(path, os.stat(path).st_mtime_ns)
+
+
+def report_key(name: str, data: dict | None) -> str:
+    """Content key of the report: changes whenever the player's row or the bytes of their avatar change."""
+    digest = sha256(json.dumps({"name": name, "data": data}, sort_keys=True).encode())
+    if data is not None:
+        try:
+            with open(f"{AVATARS_DIR}/{data['avatar']}", "rb") as file:
+                digest.update(file.read())
+        except OSError:
+            pass
+
+    return digest.hexdigest()
+
 
-def target(queue_in):
+def render(key: str, name: str, data: dict | None) -> None:
+    """Draws the report of one player; runs in a worker process, so it gets the player's row from the caller."""
     not_in_db = "Not in db"
+    # Файл появляется под своим ключом только целиком, так что его не отдадут недописанным
+    path = f"{PDFS_DIR}/{key}.pdf.{os.getpid()}.tmp"
+    crud.set_pdf_job(key, "running")
 
-    while True:
-        task_id, name = queue_in.get()
-        if (data := crud.get_player(name)) is None:
-            canvas = Canvas(f"contents/pdfs/{task_id}.pdf", pagesize=(300, 110))
-            canvas.drawString(12, 25, f"No such player: {name}")
-            canvas.save()
+    if data is None:
+        canvas = Canvas(path, pagesize=(300, 110))
+        canvas.drawString(12, 25, f"No such player: {name}")
+        canvas.save()
 
+    else:
+        canvas = Canvas(path, pagesize=(300, 110))
+        canvas.drawString(10, 90, f"Name: {data['name']}")
+        canvas.drawString(10, 80, f"Age: {not_in_db if data.get('age') is None else data['age']}")
+        canvas.drawString(10, 70, f"Email: {not_in_db if data.get('email') is None else data['email']}")
+        canvas.drawString(10, 60, f"Wins: {not_in_db if data.get('wins') is None else data['wins']}")
+        canvas.drawString(10, 40, f"Losses: {not_in_db if data.get('losses') is None else data['losses']}")
+        canvas.drawString(10, 30, f"Gender: {not_in_db if data.get('gender') is None else data['gender']}")
+        canvas.drawString(10, 20, f"Time played: {not_in_db if data.get('time_played') is None else (str(round(data['time_played'])) + 'seconds')}")
+
+        canvas.drawImage(avatar_reader(data['avatar']), x=200, y=10, width=50, height=50)
+        canvas.save()
+
+    os.replace(path, f"{PDFS_DIR}/{key}.pdf")
+
+
+class PdfRenderer:
+    """Renders player reports on a pool of worker processes and keeps them on disk by content key.
+
+    Jobs live in the database, so all server processes share them: a report that is on disk or being rendered by
+    any process is not rendered again, its status can be polled through any process, and the least recently
+    requested reports are deleted once all of them take more than `cache_bytes`. At most `queue_size` jobs of this
+    process wait for a free worker; `submit` refuses new ones beyond that. The last `history` failed jobs keep
+    their error, and a job nobody has updated for `job_timeout` s is considered abandoned.
+    """
+
+    def __init__(self, workers: int, queue_size: int, history: int, cache_bytes: int, job_timeout: float):
+        # spawn, а не fork: родитель многопоточный, и форк мог бы унаследовать чужие захваченные блокировки
+        self.executor = futures.ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+        self.slots = BoundedSemaphore(workers + queue_size)
+        self.history = history
+        self.cache_bytes = cache_bytes
+        self.job_timeout = job_timeout
+
+        # Диск сверяется с базой при первом обращении, а не при создании: модуль сервера импортируют и процессы
+        # пула, и тогда, когда таблиц ещё нет
+        self.loaded = False
+        self.lock = Lock()
+
+    def _load_cache(self) -> None:
+        with self.lock:
+            if self.loaded:
+                return
+
+            # Отчёты с диска, о которых база не знает (например, отрисованные до неё), считаются готовыми
+            entries = []
+            for entry in os.scandir(PDFS_DIR):
+                if entry.name.endswith(".pdf"):
+                    stat = entry.stat()
+                    entries.append((entry.name.removesuffix(".pdf"), stat.st_size, stat.st_mtime))
+            crud.add_pdf_jobs(entries)
+            self.loaded = True
+
+    def submit(self, name: str, data: dict | None) -> str | None:
+        """Returns the job id of the report of `name`, queueing it if needed, or None when the queue is full."""
+        self._load_cache()
+        key = report_key(name, data)
+
+        if (job := crud.get_pdf_job(key)) is not None:
+            if job["status"] == "done":
+                if os.path.exists(f"{PDFS_DIR}/{key}.pdf"):
+                    crud.touch_pdf_job(key)
+                    return key
+                crud.delete_pdf_job(key)  # Файл удалили мимо сервера
+            elif job["status"] != "failed" and job["used"] >= time.time() - self.job_timeout:
+                return key
+
+        if not self.slots.acquire(blocking=False):
+            return None
+
+        # Из двух процессов, одновременно дошедших сюда с одним ключом, задание получит один
+        try:
+            claimed = crud.claim_pdf_job(key, time.time() - self.job_timeout)
+        except Exception:
+            self.slots.release()
+            raise
+        if not claimed:
+            self.slots.release()
+            return key
+
+        try:
+            job = self.executor.submit(render, key, name, data)
+        except Exception:
+            self.slots.release()
+            crud.delete_pdf_job(key)
+            raise
+        job.add_done_callback(lambda job: self._finish(key, job))
+
+        return key
+
+    def _finish(self, key: str, job: futures.Future) -> None:
+        self.slots.release()
+
+        if job.cancelled():
+            logger.info("Pdf %s was cancelled", key)
+            crud.set_pdf_job(key, "failed", error="cancelled")
+        elif (exception := job.exception()) is not None:
+            logger.error("Failed to generate pdf %s: %r", key, exception)
+            crud.set_pdf_job(key, "failed", error=repr(exception))
         else:
-            canvas = Canvas(f"contents/pdfs/{task_id}.pdf", pagesize=(300, 110))
-            canvas.drawString(10, 90, f"Name: {data['name']}")
-            canvas.drawString(10, 80, f"Age: {not_in_db if data.get('age') is None else data['age']}")
-            canvas.drawString(10, 70, f"Email: {not_in_db if data.get('email') is None else data['email']}")
-            canvas.drawString(10, 60, f"Wins: {not_in_db if data.get('wins') is None else data['wins']}")
-            canvas.drawString(10, 40, f"Losses: {not_in_db if data.get('losses') is None else data['losses']}")
-            canvas.drawString(10, 30, f"Gender: {not_in_db if data.get('gender') is None else data['gender']}")
-            canvas.drawString(10, 20, f"Time played: {not_in_db if data.get('time_played') is None else (str(round(data['time_played'])) + 'seconds')}")
-
-            canvas.drawImage(f"contents/avatars/{data['avatar']}", x=200, y=10, width=50, height=50)
-            canvas.save()
-
-        logger.info("Generated pdf successfully")
+            logger.info("Generated pdf %s successfully", key)
+            crud.set_pdf_job(key, "done", size=os.path.getsize(f"{PDFS_DIR}/{key}.pdf"))
+
+        for old_key in crud.evict_pdf_jobs(self.cache_bytes, self.history):
+            try:
+                os.remove(f"{PDFS_DIR}/{old_key}.pdf")
+            except FileNotFoundError:
+                pass
+            logger.info("Evicted pdf %s", old_key)
+
+    def status(self, key: str) -> dict | None:
+        """Returns the state of the job (queued, running, done or failed), None for an unknown or forgotten one."""
+        self._load_cache()
+        if (job := crud.get_pdf_job(key)) is None:
+            return None
+
+        if job["status"] == "done":
+            return {"id": key, "status": "done"} if os.path.exists(f"{PDFS_DIR}/{key}.pdf") else None
+        if job["status"] == "failed":
+            return {"id": key, "status": "failed", "error": job["error"]}
+        # Процесс, который взял задание, пропал вместе со своей очередью; следующий submit возьмёт его заново
+        if job["used"] < time.time() - self.job_timeout:
+            return {"id": key, "status": "failed", "error": "abandoned"}
+        return {"id": key, "status": job["status"]}
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)